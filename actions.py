@@ -1,120 +1,313 @@
-from gmus import *
-from spotify import *
-from takeout import *
-from actions import *
-import datetime
-
-def setup(name):
-    if os.getenv('GOOGLE_TAKEOUT_DIR'):
-        gmus = GoogleMusicTakeoutClient()
-    elif os.getenv('GOOGLE_USERNAME'):
-        gmus = GMusicClient()
-    else:
-        raise Exception('No google env vars set')
+import os
+import time
 
-    if os.getenv('SPOTIFY_CLIENT_ID') and os.getenv('SPOTIFY_CLIENT_SECRET') and os.getenv('SPOTIFY_REDIRECT_URL') and os.getenv('SPOTIFY_USERNAME'):
-        spot = SpotifyClient()
-    else:
-        raise Exception('Missing spotify env vars')
+import backends
+from library import LibraryIndex
+from parallel import imap
+from sync import plan
+from writer import BatchWriter, SAVED_ALBUMS_BATCH, FOLLOWED_ARTISTS_BATCH, PLAYLIST_BATCH
+from resolver import TrackResolver
+from journal import Journal
+from pipeline import pipeline
+from report import Report
+from normalize import track_search, album_search, artist_search
 
-    log = open('actions.log', 'a+')
+def setup(name, resume=False, refresh=False):
+    # Only the backends in use are imported
+    gmus = backends.google_client(refresh)
+    spot = backends.spotify_client()
 
-    log.write('----------------------------------------------------------------------------------------\n')
-    log.write('Starting\t' + name + '\t' + datetime.datetime.now().strftime("%I:%M%p on %B %d, %Y") + '\n')
+    report = Report('report-' + name + '.' + os.getenv('REPORT_FORMAT', 'jsonl'), name)
+    journal = Journal(name, resume)
 
-    return (gmus, spot, log)
+    return (gmus, spot, report, journal)
 
-def albums(add):
-    gmus, spot, log = setup('albums')
+# Returned by a search that was skipped because the user already has the item
+ALREADY = object()
 
-    prev = []
-    uris = []
-    for song in gmus.get_all_songs():
-        key = song['artist'] + ':' + song['album']
-        if key in prev:
-            continue
-        prev.append(key)
-        if song['deleted']:
-            continue
-        if song['playCount'] == 0:
-            continue
-        uri = spot.get_album_uri(song)
-        if uri is not None:
-            log.write('Found\t' + song['artist'] + '\t' + song['album'] + '\t' + uri + '\n')
-            uris.append(uri)
-        else:
-            log.write('Skipped\t' + song['artist'] + '\t' + song['album'] + '\n')
-        if len(uris) > 50:
-            if add:
-                spot.add_album_uris(uris)
-            uris = []
-    if len(uris) > 0 and add:
-        spot.add_album_uris(uris)
-
-def artists(add):
-    gmus, spot, log = setup('artists')
-
-    prev = []
-    uris = []
-    for song in gmus.get_all_songs():
-        key = song['artist']
-        if key in prev:
-            continue
-        prev.append(key)
-        if song['deleted']:
-            continue
-        if song['playCount'] == 0:
+def match(find, songs, workers):
+    """
+    Runs find on each song using a pool of workers, yielding (song, result,
+    seconds it took) in the same order the songs came in, so the report
+    reads the same as when searching one at a time. Only a few searches are
+    queued ahead of the one being waited on.
+    """
+    return imap(lambda song: (song,) + timed(find, song), songs, workers)
+
+def stream_library(gmus, spot, name, select, find, workers=1):
+    """
+    Streams the Google library through a LibraryIndex, which only keeps the
+    keys of the wanted artists and albums, and runs find on the songs worth
+    looking up. select(song, artist, album) gets each song with whether it
+    made its artist and album worth migrating for the first time, and
+    returns what to pass to find, or None to skip the song.
+        return: (what match yields, the progress line)
+    """
+    index = LibraryIndex()
+    songs = spot.metrics.source('google library', gmus.get_all_songs)
+    progress = spot.metrics.progress(name, gmus.count_songs())
+
+    def wanted(tracks):
+        for track in tracks:
+            progress.step()
+            item = select(track, *index.add(track))
+            if item is not None:
+                yield item
+
+    return (pipeline(songs, [wanted, lambda items: match(find, items, workers)]), progress)
+
+def albums(add, workers=1, resume=False, refresh=False):
+    gmus, spot, report, journal = setup('albums', resume, refresh)
+    writer = BatchWriter()
+    writer.target('albums', spot.add_album_uris, SAVED_ALBUMS_BATCH, unique=True, done=lambda uris: journal.commit('albums', uris))
+    progress = None
+    try:
+        spot.load_saved_albums()
+
+        results, progress = stream_library(gmus, spot, 'albums', lambda song, artist, album: song if album else None,
+                                           lambda song: find_album(spot, journal, song), workers)
+        for song, uri, seconds in results:
+            save_album(spot, report, journal, writer if add else None, song, uri, seconds)
+    except BaseException:
+        close(spot, report, journal, writer, progress, failing=True)
+        raise
+    close(spot, report, journal, writer, progress)
+
+def artists(add, workers=1, resume=False, refresh=False):
+    gmus, spot, report, journal = setup('artists', resume, refresh)
+    writer = BatchWriter()
+    writer.target('artists', spot.add_artist_uris, FOLLOWED_ARTISTS_BATCH, unique=True, done=lambda uris: journal.commit('artists', uris))
+    progress = None
+    try:
+        spot.load_followed_artists()
+
+        results, progress = stream_library(gmus, spot, 'artists', lambda song, artist, album: song if artist else None,
+                                           lambda song: find_artist(spot, journal, song), workers)
+        for song, uri, seconds in results:
+            follow_artist(spot, report, journal, writer if add else None, song, uri, seconds)
+    except BaseException:
+        close(spot, report, journal, writer, progress, failing=True)
+        raise
+    close(spot, report, journal, writer, progress)
+
+def playlists(add, workers=1, sync=False, resume=False, refresh=False):
+    gmus, spot, report, journal = setup('playlists', resume, refresh)
+    writer = BatchWriter()
+    progress = None
+    try:
+        progress = copy_playlists(gmus, spot, report, journal, writer, add, workers, sync)
+    except BaseException:
+        close(spot, report, journal, writer, progress, failing=True)
+        raise
+    close(spot, report, journal, writer, progress)
+
+def everything(add, workers=1, sync=False, resume=False, refresh=False):
+    """
+    Does what albums, artists and playlists do, in one run: the Google
+    library and playlists are read once and the three share their searches.
+    The playlists go first, so the albums and artists their tracks were
+    matched to are already known, and an album is looked up before its
+    artist, whose uri usually comes with it.
+    """
+    gmus, spot, report, journal = setup('all', resume, refresh)
+    writer = BatchWriter()
+    writer.target('albums', spot.add_album_uris, SAVED_ALBUMS_BATCH, unique=True, done=lambda uris: journal.commit('albums', uris))
+    writer.target('artists', spot.add_artist_uris, FOLLOWED_ARTISTS_BATCH, unique=True, done=lambda uris: journal.commit('artists', uris))
+
+    progress = None
+    try:
+        spot.load_saved_albums()
+        spot.load_followed_artists()
+
+        progress = copy_playlists(gmus, spot, report.section('playlists'), journal, writer, add, workers, sync)
+        progress.close()
+
+        def find(item):
+            song, artist, album = item
+            found = []
+            if album:
+                found.append(timed(find_album, spot, journal, song))
+            if artist:
+                found.append(timed(find_artist, spot, journal, song))
+            return found
+
+        albums_report = report.section('albums')
+        artists_report = report.section('artists')
+        results, progress = stream_library(gmus, spot, 'albums and artists',
+                                           lambda song, artist, album: (song, artist, album) if artist or album else None, find, workers)
+        for (song, artist, album), found, _ in results:
+            if album:
+                uri, seconds = found.pop(0)
+                save_album(spot, albums_report, journal, writer if add else None, song, uri, seconds)
+            if artist:
+                uri, seconds = found.pop(0)
+                follow_artist(spot, artists_report, journal, writer if add else None, song, uri, seconds)
+    except BaseException:
+        close(spot, report, journal, writer, progress, failing=True)
+        raise
+    close(spot, report, journal, writer, progress)
+
+def close(spot, report, journal, writer, progress=None, failing=False):
+    """
+    Finishes an action, even one that failed or was stopped part way: what
+    is queued is written to Spotify, and the report, the journal and the
+    metrics are written out, so they show how far it got. The first error
+    closing them is raised once everything is closed, unless the action is
+    failing with an error of its own.
+    """
+    error = None
+    for finish in (writer.close, progress.close if progress is not None else None, report.close, journal.close, spot.close):
+        if finish is None:
             continue
-        uri = spot.get_artist_uri(song)
-        if uri is not None:
-            log.write('Found\t' + song['artist'] + '\t' + uri + '\n')
-            uris.append(uri)
-        else:
-            log.write('Skipped\t' + song['artist'] + '\n')
-        if len(uris) > 50:
-            if add:
-                spot.add_artist_uris(uris)
-            uris = []
-    if len(uris) > 0 and add:
-        spot.add_artist_uris(uris)
+        try:
+            finish()
+        except Exception as e:
+            error = error or e
+    if error is not None and not failing:
+        raise error
+
+def timed(find, *args):
+    """
+    Calls find, returning (what it returned, seconds it took).
+    """
+    start = time.perf_counter()
+    result = find(*args)
+    return (result, time.perf_counter() - start)
+
+def find_album(spot, journal, song):
+    """
+    Finds the album of a song, unless the user already saved it.
+    """
+    if spot.has_album(song):
+        return ALREADY
+    return journal.lookup(LibraryIndex.album_key(song), lambda: spot.get_album_uri(song))
+
+def find_artist(spot, journal, song):
+    """
+    Finds the artist of a song, unless the user already follows them.
+    """
+    if spot.has_artist(song):
+        return ALREADY
+    return journal.lookup(LibraryIndex.artist_key(song), lambda: spot.get_artist_uri(song))
+
+def save_album(spot, report, journal, writer, song, uri, seconds):
+    """
+    Reports what was found for the album of a song and queues it to be
+    saved, unless the user has it already. Nothing is saved without a writer.
+    """
+    if uri is ALREADY:
+        report.write('already', artist=song.artist, album=song.album, seconds=seconds)
+        return
+    query = album_search(song.artist, song.album)
+    if uri is not None and (spot.has_album_uri(uri) or journal.is_committed('albums', uri)):
+        report.write('already', artist=song.artist, album=song.album, query=query, uri=uri, seconds=seconds)
+    elif uri is not None:
+        report.write('found', artist=song.artist, album=song.album, query=query, uri=uri, confidence=spot.confidence.get(uri), seconds=seconds)
+        if writer is not None:
+            writer.add('albums', [uri])
+    else:
+        report.write('unmatched', artist=song.artist, album=song.album, query=query, seconds=seconds)
 
-def playlists(add):
-    gmus, spot, log = setup('playlists')
+def follow_artist(spot, report, journal, writer, song, uri, seconds):
+    """
+    Reports what was found for the artist of a song and queues them to be
+    followed, unless the user already does. Nothing is followed without a writer.
+    """
+    if uri is ALREADY:
+        report.write('already', artist=song.artist, seconds=seconds)
+        return
+    query = artist_search(song.artist)
+    if uri is not None and (spot.has_artist_uri(uri) or journal.is_committed('artists', uri)):
+        report.write('already', artist=song.artist, query=query, uri=uri, seconds=seconds)
+    elif uri is not None:
+        report.write('found', artist=song.artist, query=query, uri=uri, confidence=spot.confidence.get(uri), seconds=seconds)
+        if writer is not None:
+            writer.add('artists', [uri])
+    else:
+        report.write('unmatched', artist=song.artist, query=query, seconds=seconds)
+
+def copy_playlists(gmus, spot, report, journal, writer, add, workers=1, sync=False):
+    """
+    Finds the songs of every Google playlist and queues them on writer,
+    creating the playlists that don't exist yet if adding.
+        return: the progress line, left for the caller to close
+    """
+    resolver = TrackResolver(spot, workers, journal)
+
+    # Read every playlist first, so a song in many playlists is only searched for once
+    lists = []
+    for playlist in spot.metrics.source('google playlists', gmus.get_playlists):
+        lists.append((playlist.get_name(), [song for song in playlist if not song.deleted and song.play_count != 0]))
+    progress = spot.metrics.progress('playlists', unit='songs')
+    found = resolver.resolve((song for name, songs in lists for song in songs), progress)
 
-    for playlist in gmus.get_playlists():
-        name = playlist.get_name()
+    for name, songs in lists:
+        if journal.is_finished(name):
+            report.write('playlist_done', playlist=name)
+            continue
         id = spot.get_playlist(name)
         if id is not None:
-            log.write('Playlist Found\t' + name + '\t' + id + '\n')
+            report.write('playlist_found', playlist=name, uri='spotify:playlist:' + id)
         else:
-            log.write('Creating Playlist\t' + name + '\n')
+            report.write('playlist_created', playlist=name)
             if add:
                 id = spot.add_playlist(name)
 
-        first = True
+        if add:
+            writer.target(id, lambda uris, id=id: spot.add_song_to_playlist_uris(id, uris), PLAYLIST_BATCH,
+                          first=lambda uris, id=id: spot.replace_songs_to_playlist_uris(id, uris))
+
         uris = []
-        for song in playlist:
-            if song['deleted']:
-                continue
-            if song['playCount'] == 0:
-                continue
-            uri = spot.get_song_uri(song)
+        for song in songs:
+            key = LibraryIndex.song_key(song)
+            uri = found[key]
+            query = track_search(song.title, song.artist, song.album)
             if uri is not None:
-                log.write('Adding\t' + song['artist'] + '\t' + song['album'] + '\t' + song['title'] + '\t' + uri + '\n')
+                report.write('found', playlist=name, title=song.title, artist=song.artist, album=song.album, query=query,
+                             uri=uri, confidence=spot.confidence.get(uri), seconds=resolver.seconds.get(key))
                 uris.append(uri)
             else:
-                log.write('Skipped\t' + song['artist'] + '\t' + song['album'] + '\t' + song['title'] + '\n')
-
-            if len(uris) == 100:
-                if add:
-                    if first:
-                        spot.replace_songs_to_playlist_uris(id, uris)
-                        first = False
-                    else:
-                        spot.add_song_to_playlist_uris(id, uris)
-                uris = []
-        if len(uris) > 0 and add:
-            if first:
-                spot.replace_songs_to_playlist_uris(id, uris)
-            else:
-                spot.add_song_to_playlist_uris(id, uris)
+                report.write('unmatched', playlist=name, title=song.title, artist=song.artist, album=song.album, query=query,
+                             seconds=resolver.seconds.get(key))
+
+        # When syncing we need the whole playlist before we can compare
+        if sync:
+            sync_playlist(spot, report, writer if add else None, name, id, uris)
+        elif add:
+            writer.add(id, uris)
+        # A playlist that was only partly written is rewritten from the start on resume
+        if add:
+            writer.run(id, lambda name=name: journal.finish(name))
+    return progress
+
+def sync_playlist(spot, report, writer, name, id, uris):
+    """
+    Makes a Spotify playlist match uris with as few writes as possible,
+    leaving it alone if it already does. Nothing is written without a writer.
+    """
+    current = spot.get_playlist_uris(id) if id is not None else []
+    steps = plan(current, uris)
+    if len(steps) == 0:
+        report.write('playlist_unchanged', playlist=name)
+        return
+    report.write('playlist_sync', playlist=name, changes=' '.join(step[0] for step in steps))
+    if writer is not None:
+        writer.run(id, lambda: write_steps(spot, id, steps))
+
+def write_steps(spot, id, steps):
+    """
+    Carries out the steps planned by sync.plan.
+    """
+    for step in steps:
+        if step[0] == 'replace':
+            spot.replace_songs_to_playlist_uris(id, step[1][:PLAYLIST_BATCH])
+            for i in range(PLAYLIST_BATCH, len(step[1]), PLAYLIST_BATCH):
+                spot.add_song_to_playlist_uris(id, step[1][i:i + PLAYLIST_BATCH])
+        elif step[0] == 'add':
+            for i in range(0, len(step[1]), PLAYLIST_BATCH):
+                spot.add_song_to_playlist_uris(id, step[1][i:i + PLAYLIST_BATCH])
+        elif step[0] == 'remove':
+            for i in range(0, len(step[1]), PLAYLIST_BATCH):
+                spot.remove_songs_from_playlist_uris(id, step[1][i:i + PLAYLIST_BATCH])
+        else:
+            spot.move_song_in_playlist(id, step[1], step[2])
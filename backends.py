@@ -0,0 +1,50 @@
+"""
+Where the music comes from (Google Music or a Takeout) and goes to (Spotify).
+Each backend's module is only imported when it is picked: gmusicapi takes a
+long time to import and isn't needed at all for a Takeout, and nothing has
+to be imported just to print usage.
+"""
+
+import os
+
+def takeout(refresh=False):
+    from takeout import GoogleMusicTakeoutClient
+    return GoogleMusicTakeoutClient()
+
+def gmusic(refresh=False):
+    from gmus import GMusicClient
+    return GMusicClient(refresh=refresh)
+
+# Name -> function making the client, given whether to refresh cached data
+GOOGLE = { 'takeout' : takeout, 'gmusic' : gmusic }
+
+def register_google(name, create):
+    """
+    Adds a Google backend, which can then be picked with GOOGLE_SOURCE.
+    """
+    GOOGLE[name] = create
+
+def google_source():
+    """
+    Picks the Google backend: GOOGLE_SOURCE if set, otherwise the Takeout
+    when GOOGLE_TAKEOUT_DIR is set, otherwise Google Music.
+    """
+    if os.getenv('GOOGLE_SOURCE'):
+        return os.getenv('GOOGLE_SOURCE')
+    if os.getenv('GOOGLE_TAKEOUT_DIR'):
+        return 'takeout'
+    if os.getenv('GOOGLE_USERNAME'):
+        return 'gmusic'
+    raise Exception('No google env vars set')
+
+def google_client(refresh=False):
+    source = google_source()
+    if source not in GOOGLE:
+        raise Exception('Unknown GOOGLE_SOURCE ' + source + ', pick one of ' + ', '.join(sorted(GOOGLE)))
+    return GOOGLE[source](refresh)
+
+def spotify_client():
+    if not (os.getenv('SPOTIFY_CLIENT_ID') and os.getenv('SPOTIFY_CLIENT_SECRET') and os.getenv('SPOTIFY_REDIRECT_URL') and os.getenv('SPOTIFY_USERNAME')):
+        raise Exception('Missing spotify env vars')
+    from spotify import SpotifyClient
+    return SpotifyClient()
@@ -0,0 +1,190 @@
+"""
+Makes up music libraries to benchmark with: a Google library (shaped like
+gmusicapi's song and playlist dicts), the Takeout export of it and the
+Spotify catalog the stand-in server searches. Everything comes from a seed,
+so the same arguments always give the same library.
+
+    python bench/generate.py DIR --tracks 10000 --playlists 50 --zip 2
+"""
+
+import os
+import io
+import csv
+import json
+import random
+import zipfile
+import argparse
+
+SYLLABLES = ['ka', 'lo', 'mi', 'ra', 'ne', 'su', 'ta', 'vo', 'zi', 'el', 'an', 'or', 'by', 'qu', 'fe', 'do', 'ri', 'pa', 'gu', 'sha']
+# Ways Google's names differ from Spotify's for the same thing
+TITLE_EXTRAS = [' (Remastered 2011)', ' - Live', ' (feat. %s)', ' [Radio Edit]']
+ALBUM_EXTRAS = [' (Deluxe Edition)', ' [Expanded]', ' (Remastered)']
+
+class Library:
+    """
+    A made up library. songs and playlists are what gmusicapi would give,
+    spotify is what the stand-in server has: lists of tracks, albums and
+    artists.
+    """
+    def __init__(self, songs, playlists, spotify):
+        self.songs = songs
+        self.playlists = playlists
+        self.spotify = spotify
+
+    def save(self, path):
+        with open(path, 'w') as library_file:
+            json.dump({ 'songs' : self.songs, 'playlists' : self.playlists, 'spotify' : self.spotify }, library_file)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as library_file:
+            data = json.load(library_file)
+        return cls(data['songs'], data['playlists'], data['spotify'])
+
+def word(rand):
+    return ''.join(rand.choice(SYLLABLES) for _ in range(rand.randint(1, 3))).capitalize()
+
+def name(rand, words):
+    return ' '.join(word(rand) for _ in range(rand.randint(1, words)))
+
+def generate(tracks=1000, playlists=10, playlist_size=50, duplicates=0.05, missing=0.05, seed=1):
+    """
+    Makes a library of the given number of tracks, a duplicates fraction of
+    them being copies of other tracks (like the same song added twice) and
+    a missing fraction of the rest not being on Spotify.
+    """
+    rand = random.Random(seed)
+    artists = [{ 'id' : 'ar%07d' % i, 'name' : name(rand, 2) } for i in range(max(1, tracks // 40))]
+    albums = []
+    spotify_tracks = []
+    songs = []
+    unique = max(1, int(tracks * (1 - duplicates)))
+    while len(songs) < unique:
+        artist = rand.choice(artists)
+        album = { 'id' : 'al%07d' % len(albums), 'name' : name(rand, 3), 'artists' : [artist] }
+        albums.append(album)
+        album_name = album['name'] + (rand.choice(ALBUM_EXTRAS) if rand.random() < 0.1 else '')
+        for number in range(1, rand.randint(6, 14) + 1):
+            if len(songs) >= unique:
+                break
+            track = { 'id' : 'tr%07d' % len(spotify_tracks), 'name' : name(rand, 4), 'artists' : [artist],
+                      'album' : album, 'track_number' : number }
+            title = track['name']
+            if rand.random() < 0.1:
+                extra = rand.choice(TITLE_EXTRAS)
+                title += extra % rand.choice(artists)['name'] if '%s' in extra else extra
+            if rand.random() >= missing:
+                spotify_tracks.append(track)
+            songs.append(song(len(songs), title, artist['name'], album_name, number, rand))
+
+    for i in range(tracks - len(songs)):
+        copy = dict(rand.choice(songs))
+        copy['id'] = 'song-%07d' % len(songs)
+        songs.append(copy)
+    rand.shuffle(songs)
+
+    lists = []
+    for i in range(playlists):
+        entries = [{ 'track' : s } for s in rand.sample(songs, min(len(songs), playlist_size))]
+        lists.append({ 'id' : 'playlist-%05d' % i, 'name' : 'Playlist ' + name(rand, 2), 'tracks' : entries,
+                       'lastModifiedTimestamp' : '1500000000000000' })
+
+    used = set(t['album']['id'] for t in spotify_tracks)
+    spotify = { 'tracks' : spotify_tracks, 'albums' : [a for a in albums if a['id'] in used], 'artists' : artists }
+    return Library(songs, lists, spotify)
+
+def song(i, title, artist, album, number, rand):
+    """
+    A song the way gmusicapi gives it, with only the fields we read.
+    """
+    return { 'id' : 'song-%07d' % i, 'title' : title, 'artist' : artist, 'album' : album, 'trackNumber' : number,
+             'playCount' : str(0 if rand.random() < 0.2 else rand.randint(1, 200)), 'deleted' : rand.random() < 0.02,
+             'lastModifiedTimestamp' : str(1500000000000000 + i) }
+
+TRACK_FIELDS = ['Title', 'Album', 'Artist', 'Duration (ms)', 'Rating', 'Play Count', 'Removed']
+
+def takeout_files(library, audio=0):
+    """
+    Gives (path, bytes) for every file in the library's Takeout, paths
+    relative to the "Google Play Music" folder. With audio, each track also
+    gets that many bytes of (random) audio, like the real export.
+    """
+    rand = random.Random(0)
+    names = set()
+    for s in library.songs:
+        base = ''.join(c for c in s['title'] if c.isalnum() or c == ' ')
+        filename = base
+        n = 1
+        while filename in names:
+            filename = '%s(%d)' % (base, n)
+            n += 1
+        names.add(filename)
+        yield ('Tracks/' + filename + '.csv', track_csv(s, TRACK_FIELDS))
+        if audio > 0:
+            yield ('Tracks/' + filename + '.mp3', bytes(rand.getrandbits(8) for _ in range(audio)))
+
+    for plist in library.playlists:
+        folder = 'Playlists/' + plist['name'] + '/'
+        yield (folder + 'Metadata.csv', csv_bytes(['Title', 'Owner', 'Description', 'Shared', 'Deleted'], [plist['name'], 'bench', '', '', '']))
+        for i, entry in enumerate(plist['tracks']):
+            yield (folder + 'Tracks/%d.csv' % i, track_csv(entry['track'], TRACK_FIELDS + ['Playlist Index'], [str(i)]))
+
+def track_csv(s, fields, extra=[]):
+    row = [s['title'], s['album'], s['artist'], '200000', '', s['playCount'], 'Yes' if s['deleted'] else '']
+    return csv_bytes(fields, row + extra)
+
+def csv_bytes(fields, row):
+    text = io.StringIO()
+    writer = csv.writer(text)
+    writer.writerow(fields)
+    writer.writerow(row)
+    return text.getvalue().encode()
+
+def write_takeout(library, path, zips=0, audio=0):
+    """
+    Writes the library's Takeout under path, as a "Google Play Music"
+    folder or split over that many zips.
+        return: what to set GOOGLE_TAKEOUT_DIR to
+    """
+    if zips == 0:
+        root = os.path.join(path, 'Google Play Music')
+        for name, data in takeout_files(library, audio):
+            full = os.path.join(root, name)
+            os.makedirs(os.path.dirname(full), exist_ok=True)
+            with open(full, 'wb') as takeout_file:
+                takeout_file.write(data)
+        return root
+
+    os.makedirs(path, exist_ok=True)
+    archives = [zipfile.ZipFile(os.path.join(path, 'takeout-%03d.zip' % (i + 1)), 'w') for i in range(zips)]
+    for i, (name, data) in enumerate(takeout_files(library, audio)):
+        archives[i % zips].writestr('Takeout/Google Play Music/' + name, data)
+    for archive in archives:
+        archive.close()
+    return path
+
+def main():
+    parser = argparse.ArgumentParser(description='Makes up a library to benchmark with.')
+    parser.add_argument('dir', help='where to write library.json and the Takeout')
+    add_arguments(parser)
+    args = parser.parse_args()
+    library = from_arguments(args)
+    os.makedirs(args.dir, exist_ok=True)
+    library.save(os.path.join(args.dir, 'library.json'))
+    print('GOOGLE_TAKEOUT_DIR=' + write_takeout(library, args.dir, args.zip, args.audio))
+
+def add_arguments(parser):
+    parser.add_argument('--tracks', type=int, default=1000)
+    parser.add_argument('--playlists', type=int, default=10)
+    parser.add_argument('--playlist-size', type=int, default=50)
+    parser.add_argument('--duplicates', type=float, default=0.05, help='fraction of tracks that are copies of others')
+    parser.add_argument('--missing', type=float, default=0.05, help='fraction of tracks Spotify does not have')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--zip', type=int, default=0, help='write the Takeout as this many zips')
+    parser.add_argument('--audio', type=int, default=0, help='bytes of audio to write with each track')
+
+def from_arguments(args):
+    return generate(args.tracks, args.playlists, args.playlist_size, args.duplicates, args.missing, args.seed)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,35 @@
+"""
+Stands in for gmusicapi's Mobileclient with a made up library, so
+GMusicClient can be benchmarked without a Google account.
+"""
+
+PAGE_SIZE = 1000
+
+class Mobileclient:
+    def __init__(self, library):
+        self.library = library
+        self.calls = 0
+
+    def get_all_songs(self, incremental=False, include_deleted=None, updated_after=None):
+        songs = self.library.songs
+        if updated_after is not None:
+            after = updated_after.timestamp() * 1000000
+            songs = [s for s in songs if int(s['lastModifiedTimestamp']) > after]
+        if not include_deleted:
+            songs = [s for s in songs if not s['deleted']]
+        return self.pages(songs, incremental)
+
+    def get_all_playlists(self, incremental=False):
+        return self.pages([{ 'id' : p['id'], 'name' : p['name'], 'lastModifiedTimestamp' : p['lastModifiedTimestamp'] }
+                           for p in self.library.playlists], incremental)
+
+    def get_all_user_playlist_contents(self):
+        self.calls += 1
+        return self.library.playlists
+
+    def pages(self, items, incremental):
+        pages = [items[i:i + PAGE_SIZE] for i in range(0, len(items), PAGE_SIZE)]
+        self.calls += max(1, len(pages))
+        if incremental:
+            return iter(pages)
+        return [item for page in pages for item in page]
@@ -0,0 +1,59 @@
+"""
+Checks that a throttled request waits exactly as long as Spotify's
+Retry-After says: the stand-in answers the first request with a 429 and
+the time until the request comes back is compared with the Retry-After.
+
+    python bench/retry.py --retry-after 2.5
+"""
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+BENCH = os.path.dirname(os.path.realpath(__file__))
+REPO = os.path.dirname(BENCH)
+sys.path.insert(0, BENCH)
+
+from generate import generate
+from server import SpotifyStandIn
+
+def main():
+    parser = argparse.ArgumentParser(description='Checks that throttled requests wait for Retry-After.')
+    parser.add_argument('--retry-after', type=float, default=2.5)
+    parser.add_argument('--tolerance', type=float, default=0.25, help='seconds the wait may be off by')
+    args = parser.parse_args()
+
+    stand_in = SpotifyStandIn(generate(tracks=10, playlists=0).spotify, throttle=1.0, retry_after=args.retry_after).start()
+    # Only the first request is throttled, and when each request came in is kept
+    arrived = []
+    handle = stand_in.handle
+    def first_throttled(request):
+        arrived.append(time.monotonic())
+        handle(request)
+        stand_in.throttle = 0.0
+    stand_in.handle = first_throttled
+
+    os.environ.update({ 'SPOTIFY_API_URL' : stand_in.url, 'SPOTIFY_USERNAME' : 'bench-retry' })
+    os.environ.pop('SPOTIFY_CATALOG', None)
+    sys.path.insert(0, REPO)
+    from spotify import SpotifyClient
+    try:
+        with tempfile.TemporaryDirectory() as work:
+            os.chdir(work)
+            spot = SpotifyClient()
+            spot.user()
+    finally:
+        stand_in.stop()
+        cache = os.path.join(REPO, '.cache-search-bench-retry')
+        if os.path.isfile(cache):
+            os.remove(cache)
+
+    waited = arrived[1] - arrived[0]
+    ok = len(arrived) == 2 and abs(waited - args.retry_after) <= args.tolerance
+    print('Retry-After %.2fs, waited %.2fs over %d requests: %s' % (args.retry_after, waited, len(arrived), 'ok' if ok else 'FAILED'))
+    sys.exit(0 if ok else 1)
+
+if __name__ == '__main__':
+    main()
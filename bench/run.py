@@ -0,0 +1,176 @@
+"""
+Benchmarks the actions against a made up library and the local Spotify
+stand-in, reporting tracks per second, Spotify requests per track and peak
+memory for each.
+
+    python bench/run.py --tracks 20000 --latency 0.05 --throttle 0.01 --workers 8
+
+Each action runs in its own process, so its peak memory is its own. The
+stand-in keeps what was saved, so later actions (and repeats) see the
+library as the earlier ones left it. Caches are cleared before each action
+unless --warm, and --repeat runs each action again with warm caches.
+"""
+
+import os
+import sys
+import glob
+import json
+import time
+import shutil
+import argparse
+import resource
+import tempfile
+import subprocess
+
+BENCH = os.path.dirname(os.path.realpath(__file__))
+REPO = os.path.dirname(BENCH)
+sys.path.insert(0, BENCH)
+
+from generate import Library, add_arguments, from_arguments, write_takeout
+from server import SpotifyStandIn
+
+ACTIONS = ['albums', 'artists', 'playlists']
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks the actions against a local Spotify stand-in.')
+    add_arguments(parser)
+    parser.add_argument('--source', choices=['takeout', 'gmusic'], default='takeout')
+    parser.add_argument('--actions', nargs='+', choices=ACTIONS + ['all'], default=ACTIONS)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--sync', action='store_true', help='run playlists with --sync')
+    parser.add_argument('--dry', action='store_true', help='search without saving anything')
+    parser.add_argument('--latency', type=float, default=0.02, help='seconds added to every request')
+    parser.add_argument('--throttle', type=float, default=0.0, help='fraction of requests answered with a 429')
+    parser.add_argument('--retry-after', type=float, default=0.1, help='Retry-After sent with 429s')
+    parser.add_argument('--rate', type=float, help='SPOTIFY_RATE_LIMIT for the runs')
+    parser.add_argument('--warm', action='store_true', help="don't clear the caches first")
+    parser.add_argument('--repeat', type=int, default=1, help='times to run each action')
+    parser.add_argument('--json', help='also write the results, with requests by endpoint, here')
+    parser.add_argument('--keep', action='store_true', help='keep the generated files and logs')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        return child(args.child)
+
+    work = tempfile.mkdtemp(prefix='gooify-bench-')
+    print('Generating', args.tracks, 'tracks in', work)
+    library = from_arguments(args)
+    library_path = os.path.join(work, 'library.json')
+    library.save(library_path)
+
+    env = dict(os.environ)
+    for name in ('SPOTIFY_CATALOG', 'GOOGLE_TAKEOUT_DIR', 'GOOGLE_USERNAME'):
+        env.pop(name, None)
+    env.update({ 'SPOTIFY_USERNAME' : 'bench', 'SPOTIFY_CLIENT_ID' : 'bench', 'SPOTIFY_CLIENT_SECRET' : 'bench',
+                 'SPOTIFY_REDIRECT_URL' : 'http://127.0.0.1/' })
+    if args.source == 'takeout':
+        env['GOOGLE_TAKEOUT_DIR'] = write_takeout(library, os.path.join(work, 'takeout'), args.zip, args.audio)
+    else:
+        env['GOOGLE_USERNAME'] = 'bench'
+    if args.rate is not None:
+        env['SPOTIFY_RATE_LIMIT'] = str(args.rate)
+
+    stand_in = SpotifyStandIn(library.spotify, args.latency, args.throttle, args.retry_after).start()
+    env['SPOTIFY_API_URL'] = stand_in.url
+    existing = set(glob.glob(os.path.join(REPO, '.cache-*')))
+
+    results = []
+    try:
+        for action in args.actions:
+            for run in range(args.repeat):
+                if run == 0 and not args.warm:
+                    clear_caches(existing)
+                config = { 'action' : action, 'source' : args.source, 'library' : library_path, 'workers' : args.workers,
+                           'add' : not args.dry, 'sync' : args.sync, 'result' : os.path.join(work, 'result.json') }
+                result = run_child(config, env, work, stand_in)
+                result['run'] = run + 1
+                results.append(result)
+                report(result)
+    finally:
+        stand_in.stop()
+        if args.keep:
+            print('Kept', work)
+        else:
+            shutil.rmtree(work)
+        clear_caches(existing)
+
+    if args.json:
+        with open(args.json, 'w') as json_file:
+            json.dump({ 'arguments' : { k : v for k, v in vars(args).items() if k != 'child' }, 'results' : results }, json_file, indent=2)
+
+def clear_caches(existing):
+    """
+    Removes the caches the runs left in the repo. Caches that were there
+    before (the user's own) are left alone.
+    """
+    for path in glob.glob(os.path.join(REPO, '.cache-*')):
+        if path not in existing:
+            os.remove(path)
+
+def run_child(config, env, work, stand_in):
+    """
+    Runs one action in its own process.
+        return: what it reported, with the requests the stand-in got
+    """
+    config_path = os.path.join(work, 'config.json')
+    with open(config_path, 'w') as config_file:
+        json.dump(config, config_file)
+    stand_in.counts()
+    with open(os.path.join(work, config['action'] + '.log'), 'a') as log:
+        subprocess.run([sys.executable, os.path.realpath(__file__), '--child', config_path], env=env, cwd=work,
+                       stdout=log, stderr=subprocess.STDOUT, check=True)
+    with open(config['result']) as result_file:
+        result = json.load(result_file)
+    result['requests'] = stand_in.counts()
+    return result
+
+def child(config_path):
+    """
+    Runs an action (in the process run_child started) and writes how long
+    it took and the memory it used.
+    """
+    with open(config_path) as config_file:
+        config = json.load(config_file)
+    sys.path.insert(0, REPO)
+    import actions
+    import backends
+
+    library = Library.load(config['library'])
+    if config['source'] == 'gmusic':
+        from gmus import GMusicClient
+        from gmusic import Mobileclient
+        api = Mobileclient(library)
+        backends.register_google('bench', lambda refresh: GMusicClient(api=api, refresh=refresh))
+        os.environ['GOOGLE_SOURCE'] = 'bench'
+
+    action = config['action']
+    items = len(library.songs)
+    if action == 'playlists':
+        items = sum(len(p['tracks']) for p in library.playlists)
+    elif action == 'all':
+        items += sum(len(p['tracks']) for p in library.playlists)
+    start = time.perf_counter()
+    if action == 'albums':
+        actions.albums(config['add'], config['workers'])
+    elif action == 'artists':
+        actions.artists(config['add'], config['workers'])
+    elif action == 'playlists':
+        actions.playlists(config['add'], config['workers'], config['sync'])
+    else:
+        actions.everything(config['add'], config['workers'], config['sync'])
+    seconds = time.perf_counter() - start
+
+    with open(config['result'], 'w') as result_file:
+        json.dump({ 'action' : action, 'source' : config['source'], 'items' : items, 'seconds' : seconds,
+                    # ru_maxrss is in KB on Linux
+                    'peak_kb' : resource.getrusage(resource.RUSAGE_SELF).ru_maxrss }, result_file)
+
+def report(result):
+    calls = sum(n for endpoint, n in result['requests'].items() if endpoint != 'throttled')
+    print('%-9s run %d: %7d tracks in %7.2fs = %8.1f tracks/s, %6d requests = %5.3f per track, %4d throttled, peak %6.1f MB' % (
+        result['action'], result['run'], result['items'], result['seconds'], result['items'] / max(result['seconds'], 1e-9),
+        calls, calls / max(result['items'], 1), result['requests']['throttled'], result['peak_kb'] / 1024))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""
+Checks the scorer on matches it must get right, in particular that a track
+or album with the right name by another artist is never accepted.
+
+    python bench/scoring.py
+"""
+
+import os
+import sys
+
+REPO = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, REPO)
+
+from score import best_song, best_album, best_artist
+
+def track(name, artist, album):
+    return { 'uri' : 'spotify:track:' + name, 'name' : name, 'artists' : [{ 'uri' : 'spotify:artist:' + artist, 'name' : artist }],
+             'album' : { 'uri' : 'spotify:album:' + album, 'name' : album } }
+
+def album(name, artist):
+    return { 'uri' : 'spotify:album:' + name, 'name' : name, 'artists' : [{ 'uri' : 'spotify:artist:' + artist, 'name' : artist }] }
+
+# (what is checked, what was picked, what should have been)
+CHECKS = [
+    ('album with the same name by another artist',
+     best_album([album('Greatest Hits', 'Queen')], 'ABBA', 'Greatest Hits')[0], None),
+    ('song with the same title by another artist',
+     best_song([track('Hello', 'Lionel Richie', "Can't Slow Down")], 'Hello', 'Adele', '25')[0], None),
+    ('song with the same title and album by another artist',
+     best_song([track('Hello', 'Lionel Richie', '25')], 'Hello', 'Adele', '25')[0], None),
+    ('album with the same name by a similarly spelt artist',
+     best_album([album('Greatest Hits', 'The Beach Boys')], 'The Beatles', 'Greatest Hits')[0], None),
+    ('song by a similarly spelt artist (Prince, Princess)',
+     best_song([track('Purple Rain', 'Princess', 'Purple Rain')], 'Purple Rain', 'Prince', 'Purple Rain')[0], None),
+    ('album by a similarly spelt artist (ABBA, Abbath)',
+     best_album([album('Gold', 'Abbath')], 'ABBA', 'Gold')[0], None),
+    ('song by a similarly spelt artist (Eminem, Eminence)',
+     best_song([track('Stan', 'Eminence', 'The Marshall Mathers LP')], 'Stan', 'Eminem', 'The Marshall Mathers LP')[0], None),
+    ('artist with a similarly spelt name (Adele, Adema)',
+     best_artist([{ 'uri' : 'spotify:artist:Adema', 'name' : 'Adema' }], 'Adele')[0], None),
+    ('the right song among others',
+     best_song([track('Hello', 'Lionel Richie', "Can't Slow Down"), track('Hello', 'Adele', '25')], 'Hello', 'Adele', '25')[0],
+     track('Hello', 'Adele', '25')),
+    ('the right album with a slightly different artist',
+     best_album([album('Abbey Road', 'The Beatles')], 'Beatles', 'Abbey Road')[0], album('Abbey Road', 'The Beatles')),
+    ('song without an artist to go on',
+     best_song([track('Hello', 'Adele', '25')], 'Hello', '', '25')[0], track('Hello', 'Adele', '25')),
+    ('artist by name',
+     best_artist([{ 'uri' : 'spotify:artist:Queen', 'name' : 'Queen' }], 'Queen')[0], { 'uri' : 'spotify:artist:Queen', 'name' : 'Queen' }),
+]
+
+def main():
+    failed = 0
+    for name, picked, expected in CHECKS:
+        ok = picked == expected
+        failed += not ok
+        print('%-55s %s' % (name, 'ok' if ok else 'FAILED, picked %s' % (picked and picked['uri'])))
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,299 @@
+"""
+A local stand-in for the parts of Spotify's Web API that SpotifyClient uses:
+search, album tracks, saved albums, followed artists and playlists. It can
+add latency to every request and answer some of them with 429s, and counts
+the requests it gets by endpoint.
+
+    python bench/server.py bench-data/library.json --port 8099 --latency 0.05 --throttle 0.01
+"""
+
+import re
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs, urlencode
+
+PAGE_LIMIT = 50
+
+class SpotifyStandIn:
+    """
+    Serves a made up Spotify catalog (from generate.py) on localhost. The
+    user's library starts empty and keeps what was saved until stopped.
+    """
+    def __init__(self, spotify, latency=0.0, throttle=0.0, retry_after=1, port=0, seed=1):
+        self.latency = latency
+        self.throttle = throttle
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = Counter()
+        self.throttled = 0
+
+        self.tracks = [track_object(t) for t in spotify['tracks']]
+        self.albums = [album_object(a) for a in spotify['albums']]
+        self.artists = [artist_object(a) for a in spotify['artists']]
+        self.by_uri = { item['uri'] : item for item in self.tracks + self.albums + self.artists }
+        self.album_tracks = {}
+        for track in self.tracks:
+            self.album_tracks.setdefault(track['album']['id'], []).append(track)
+        # Word -> which items have it, for each field a search can name
+        self.index = {
+            'track' : { 'track' : words_index(self.tracks, lambda t: t['name']),
+                        'artist' : words_index(self.tracks, lambda t: t['artists'][0]['name']),
+                        'album' : words_index(self.tracks, lambda t: t['album']['name']) },
+            'album' : { 'album' : words_index(self.albums, lambda a: a['name']),
+                        'artist' : words_index(self.albums, lambda a: a['artists'][0]['name']) },
+            'artist' : { 'artist' : words_index(self.artists, lambda a: a['name']) },
+        }
+
+        self.saved_albums = []
+        self.followed = []
+        self.playlists = {}
+
+        stand_in = self
+        class Handler(RequestHandler):
+            server_version = 'SpotifyStandIn'
+            def handle_request(self):
+                stand_in.handle(self)
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self.server.daemon_threads = True
+        self.url = 'http://127.0.0.1:%d/v1/' % self.server.server_address[1]
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def counts(self):
+        """
+        Takes the request counts so far and starts counting again.
+        """
+        with self.lock:
+            counts = dict(self.requests)
+            counts['throttled'] = self.throttled
+            self.requests = Counter()
+            self.throttled = 0
+        return counts
+
+    def handle(self, request):
+        if self.latency > 0:
+            time.sleep(self.latency)
+        url = urlsplit(request.path)
+        path = url.path[len('/v1/'):].strip('/')
+        query = { k : v[-1] for k, v in parse_qs(url.query).items() }
+        route = re.sub(r'/(?=[0-9A-Za-z]*[0-9])[0-9A-Za-z]+(?=/|$)', '/{id}', path)
+        body = request.body()
+        with self.lock:
+            if self.throttle > 0 and self.random.random() < self.throttle:
+                self.throttled += 1
+                return request.reply(429, { 'error' : { 'status' : 429, 'message' : 'API rate limit exceeded' } },
+                                     { 'Retry-After' : str(self.retry_after) })
+            self.requests[request.command + ' ' + route] += 1
+            try:
+                status, body = self.route(request.command, path, query, body)
+            except KeyError as e:
+                status, body = 404, { 'error' : { 'status' : 404, 'message' : 'Not found: %s' % e } }
+        request.reply(status, body)
+
+    def route(self, method, path, query, body):
+        parts = path.split('/')
+        if path == 'search':
+            return 200, self.search(query)
+        if path == 'me':
+            return 200, { 'id' : 'bench', 'display_name' : 'bench' }
+        if path == 'me/playlists':
+            lists = [{ 'id' : id, 'name' : p['name'], 'owner' : { 'id' : 'bench' } } for id, p in self.playlists.items()]
+            return 200, self.page(lists, path, query)
+        if parts[0] == 'users' and parts[2:] == ['playlists'] and method == 'POST':
+            id = 'pl%07d' % len(self.playlists)
+            self.playlists[id] = { 'name' : body['name'], 'uris' : [] }
+            return 201, { 'id' : id, 'name' : body['name'] }
+        if parts[0] == 'playlists' and parts[2:] in (['tracks'], ['items']):
+            return self.playlist(method, self.playlists[parts[1]], path, query, body)
+        if parts[0] == 'albums' and parts[2:] == ['tracks']:
+            return 200, self.page(self.album_tracks.get(parts[1], []), path, query)
+        if path == 'me/albums' and method == 'GET':
+            return 200, self.page([{ 'album' : self.by_uri[uri] } for uri in self.saved_albums], path, query)
+        if path == 'me/following' and method == 'GET':
+            return 200, { 'artists' : self.cursor_page([self.by_uri[uri] for uri in self.followed], path, query) }
+        if method == 'PUT' and path in ('me/albums', 'me/following', 'me/library'):
+            self.save(path, query, body)
+            return 200, {}
+        return 404, { 'error' : { 'status' : 404, 'message' : 'No stand-in for ' + method + ' ' + path } }
+
+    def search(self, query):
+        """
+        Finds the items sharing the most words with the query, a rough
+        version of how forgiving Spotify's search is.
+        """
+        type = query.get('type', 'track')
+        items = { 'track' : self.tracks, 'album' : self.albums, 'artist' : self.artists }[type]
+        limit = int(query.get('limit', 10))
+        scores = Counter()
+        for field, text in fields(query.get('q', '')):
+            postings = self.index[type].get(field, self.index[type].get(type))
+            for w in words(text):
+                scores.update(postings.get(w, ()))
+        found = []
+        if len(scores) > 0:
+            top = max(scores.values())
+            found = sorted(i for i, s in scores.items() if s == top)[:limit]
+        return { type + 's' : { 'items' : [items[i] for i in found], 'total' : len(found), 'next' : None } }
+
+    def playlist(self, method, playlist, path, query, body):
+        uris = playlist['uris']
+        if method == 'GET':
+            return 200, self.page([{ 'track' : { 'uri' : uri } } for uri in uris], path, query)
+        if method == 'POST':
+            added = body if isinstance(body, list) else body.get('uris', [])
+            position = query.get('position')
+            if position is None:
+                uris.extend(added)
+            else:
+                uris[int(position):int(position)] = added
+        elif method == 'PUT' and 'range_start' in body:
+            start = body['range_start']
+            length = body.get('range_length', 1)
+            moving = uris[start:start + length]
+            before = body['insert_before']
+            del uris[start:start + length]
+            if before > start:
+                before -= length
+            uris[before:before] = moving
+        elif method == 'PUT':
+            playlist['uris'] = list(body.get('uris', []))
+        elif method == 'DELETE':
+            gone = set(t['uri'] for t in body.get('tracks', body.get('items', [])))
+            playlist['uris'] = [uri for uri in uris if uri not in gone]
+        return 200, { 'snapshot_id' : str(len(playlist['uris'])) }
+
+    def save(self, path, query, body):
+        """
+        Saves albums or follows artists, by id or by uri.
+        """
+        if 'uris' in query:
+            uris = query['uris'].split(',')
+        else:
+            ids = query['ids'].split(',') if 'ids' in query else (body or {}).get('ids', [])
+            type = 'album' if path == 'me/albums' else 'artist'
+            uris = ['spotify:%s:%s' % (type, id) for id in ids]
+        for uri in uris:
+            target = self.saved_albums if uri.startswith('spotify:album:') else self.followed
+            if uri in self.by_uri and uri not in target:
+                target.append(uri)
+
+    def page(self, items, path, query):
+        offset = int(query.get('offset', 0))
+        limit = int(query.get('limit', PAGE_LIMIT))
+        next = None
+        if offset + limit < len(items):
+            next = self.next_url(path, query, offset=offset + limit, limit=limit)
+        return { 'items' : items[offset:offset + limit], 'total' : len(items), 'offset' : offset, 'limit' : limit, 'next' : next }
+
+    def cursor_page(self, items, path, query):
+        """
+        A page of followed artists, which Spotify pages by cursor instead of offset.
+        """
+        start = 0
+        if 'after' in query:
+            start = next((i + 1 for i, item in enumerate(items) if item['id'] == query['after']), len(items))
+        limit = int(query.get('limit', PAGE_LIMIT))
+        page = items[start:start + limit]
+        next_url = None
+        if start + limit < len(items):
+            next_url = self.next_url(path, query, after=page[-1]['id'], limit=limit)
+        return { 'items' : page, 'total' : len(items), 'next' : next_url, 'cursors' : { 'after' : page[-1]['id'] if page else None } }
+
+    def next_url(self, path, query, **changes):
+        query = dict(query, **{ k : str(v) for k, v in changes.items() })
+        return self.url + path + '?' + urlencode(query)
+
+class RequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Send the headers and body together, or delayed ACKs add 40ms to every request
+    wbufsize = -1
+
+    def do_GET(self):
+        self.handle_request()
+
+    do_POST = do_PUT = do_DELETE = do_GET
+
+    def body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if length == 0:
+            return {}
+        return json.loads(self.rfile.read(length))
+
+    def reply(self, status, body, headers={}):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+def fields(q):
+    """
+    Splits a search like "track:x artist:y" into its fields.
+    """
+    found = re.findall(r'(\w+):(.*?)(?=\s\w+:|$)', q)
+    return found if len(found) > 0 else [('', q)]
+
+def words(text):
+    return re.findall(r'[a-z0-9]+', text.lower())
+
+def words_index(items, text):
+    index = {}
+    for i, item in enumerate(items):
+        for w in set(words(text(item))):
+            index.setdefault(w, []).append(i)
+    return index
+
+def artist_object(artist):
+    return { 'id' : artist['id'], 'uri' : 'spotify:artist:' + artist['id'], 'name' : artist['name'], 'type' : 'artist' }
+
+def album_object(album):
+    return { 'id' : album['id'], 'uri' : 'spotify:album:' + album['id'], 'name' : album['name'], 'type' : 'album',
+             'artists' : [artist_object(a) for a in album['artists']] }
+
+def track_object(track):
+    return { 'id' : track['id'], 'uri' : 'spotify:track:' + track['id'], 'name' : track['name'], 'type' : 'track',
+             'artists' : [artist_object(a) for a in track['artists']], 'album' : album_object(track['album']),
+             'track_number' : track['track_number'] }
+
+def main():
+    sys.path.insert(0, __file__.rsplit('/', 1)[0] if '/' in __file__ else '.')
+    from generate import Library
+
+    parser = argparse.ArgumentParser(description='Serves a stand-in for the Spotify API.')
+    parser.add_argument('library', help='library.json from generate.py')
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every request')
+    parser.add_argument('--throttle', type=float, default=0.0, help='fraction of requests answered with a 429')
+    parser.add_argument('--retry-after', type=float, default=1, help='Retry-After sent with 429s')
+    args = parser.parse_args()
+
+    stand_in = SpotifyStandIn(Library.load(args.library).spotify, args.latency, args.throttle, args.retry_after, args.port)
+    print('SPOTIFY_API_URL=' + stand_in.url)
+    try:
+        stand_in.server.serve_forever()
+    except KeyboardInterrupt:
+        print(json.dumps(stand_in.counts(), indent=2))
+
+if __name__ == '__main__':
+    main()
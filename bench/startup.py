@@ -0,0 +1,63 @@
+"""
+Checks how long the app takes to start: main.py with no action, and getting
+a Takeout source ready, each in a fresh interpreter. For comparison it also
+times importing the Google Music backend, which only runs that use it pay for.
+
+    python bench/startup.py --runs 10
+"""
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+BENCH = os.path.dirname(os.path.realpath(__file__))
+REPO = os.path.dirname(BENCH)
+sys.path.insert(0, BENCH)
+
+from generate import generate, write_takeout
+
+TAKEOUT = '''
+import sys, backends
+backends.google_client()
+print('gmusicapi' in sys.modules, 'spotipy' in sys.modules)
+'''
+
+def timed(args, env, runs):
+    """
+    Runs a command in a fresh interpreter a few times.
+        return: (median seconds, what it printed last)
+    """
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        done = subprocess.run([sys.executable] + args, env=env, cwd=REPO, capture_output=True, text=True, check=True)
+        times.append(time.perf_counter() - start)
+    return (statistics.median(times), done.stdout)
+
+def main():
+    parser = argparse.ArgumentParser(description='Times how long the app takes to start.')
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    for name in ('GOOGLE_TAKEOUT_DIR', 'GOOGLE_USERNAME', 'GOOGLE_SOURCE'):
+        env.pop(name, None)
+    with tempfile.TemporaryDirectory(prefix='gooify-startup-') as work:
+        env['GOOGLE_TAKEOUT_DIR'] = write_takeout(generate(tracks=10, playlists=1, playlist_size=5), work)
+
+        seconds, _ = timed(['-c', 'pass'], env, args.runs)
+        print('Python itself:              %6.0f ms' % (seconds * 1000))
+        seconds, _ = timed(['main.py'], env, args.runs)
+        print('main.py with no action:     %6.0f ms' % (seconds * 1000))
+        seconds, out = timed(['-c', TAKEOUT], env, args.runs)
+        gmusicapi, spotipy = out.split()
+        print('Takeout source ready:       %6.0f ms (gmusicapi imported: %s, spotipy imported: %s)' % (seconds * 1000, gmusicapi, spotipy))
+        seconds, _ = timed(['-c', 'import gmus'], env, args.runs)
+        print('Google Music backend alone: %6.0f ms (only paid when it is used)' % (seconds * 1000))
+
+if __name__ == '__main__':
+    main()
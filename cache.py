@@ -0,0 +1,100 @@
+import os
+import json
+import sqlite3
+import threading
+import time
+
+class SearchCache:
+    """
+    SearchCache keeps the results of Spotify searches on disk, so a rerun
+    doesn't have to search again for things we already found (or already
+    failed to find).
+    """
+    def __init__(self, path, ttl=None, max_entries=None):
+        """
+        Opens (or creates) the cache database at path. Entries older than
+        ttl seconds are ignored, and once there are more than max_entries
+        the least recently used ones are dropped.
+        """
+        if ttl is None:
+            ttl = float(os.getenv('SPOTIFY_CACHE_TTL_DAYS', '30')) * 86400
+        if max_entries is None:
+            max_entries = int(os.getenv('SPOTIFY_CACHE_SIZE', '200000'))
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+
+        # Searches may run on several threads, they share the one connection
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('CREATE TABLE IF NOT EXISTS search ('
+                        'type TEXT NOT NULL, '
+                        'query TEXT NOT NULL, '
+                        'result TEXT, '
+                        'created REAL NOT NULL, '
+                        'used REAL NOT NULL, '
+                        'PRIMARY KEY (type, query))')
+        self.db.execute('CREATE INDEX IF NOT EXISTS search_used ON search (used)')
+        self.db.commit()
+
+    @staticmethod
+    def key(query):
+        """
+        Normalizes a query string so trivially different spellings share an entry.
+        """
+        return ' '.join(query.lower().split())
+
+    def get(self, type, query):
+        """
+        Looks up a search. Returns (True, result) when cached, where result
+        is None for a search that found nothing, or (False, None) on a miss.
+        """
+        query = self.key(query)
+        now = time.time()
+        with self.lock:
+            row = self.db.execute('SELECT result, created FROM search WHERE type = ? AND query = ?', (type, query)).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                self.misses += 1
+                return (False, None)
+            self.db.execute('UPDATE search SET used = ? WHERE type = ? AND query = ?', (now, type, query))
+            self.hits += 1
+        return (True, None if row[0] is None else json.loads(row[0]))
+
+    def put(self, type, query, result):
+        """
+        Stores the result of a search, None meaning nothing was found.
+        """
+        query = self.key(query)
+        now = time.time()
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO search (type, query, result, created, used) VALUES (?, ?, ?, ?, ?)',
+                            (type, query, None if result is None else json.dumps(result), now, now))
+            self.writes += 1
+            if self.writes % 100 == 0:
+                self.evict()
+            self.db.commit()
+
+    def evict(self):
+        """
+        Drops expired entries, then the least recently used ones above the size limit.
+        """
+        self.db.execute('DELETE FROM search WHERE created < ?', (time.time() - self.ttl,))
+        count = self.db.execute('SELECT COUNT(*) FROM search').fetchone()[0]
+        if count > self.max_entries:
+            self.db.execute('DELETE FROM search WHERE rowid IN (SELECT rowid FROM search ORDER BY used LIMIT ?)', (count - self.max_entries,))
+
+    def stats(self):
+        """
+        A one line summary of how useful the cache was.
+        """
+        total = self.hits + self.misses
+        rate = (100.0 * self.hits / total) if total else 0.0
+        return 'Search cache: %d hits, %d misses (%.1f%% hit rate)' % (self.hits, self.misses, rate)
+
+    def close(self):
+        with self.lock:
+            self.evict()
+            self.db.commit()
+            self.db.close()
@@ -0,0 +1,139 @@
+import os
+import csv
+import sys
+import json
+
+from normalize import artist_key, album_key, title_key
+
+class Catalog:
+    """
+    Catalog is a local dump of Spotify items we can match against without
+    making any requests. Each row has a uri, title, artist and album, and
+    track rows may also have album_uri and artist_uri. Rows whose uri is an
+    album or artist uri describe that album or artist.
+
+    Tracks are found through an inverted index of the words in their
+    titles, albums and artists by their names.
+    """
+    def __init__(self):
+        self.rows = []
+        self.words = {}
+        self.albums = {}
+        self.artists = {}
+        self.tracks_by_album = {}
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def load(cls, path):
+        """
+        Loads a catalog from a .csv (with a header row) or .jsonl file.
+        """
+        catalog = cls()
+        with open(path, newline='', encoding='utf-8') as catalog_file:
+            if path.endswith('.jsonl') or path.endswith('.json'):
+                rows = (json.loads(line) for line in catalog_file if line.strip() != '')
+            else:
+                rows = csv.DictReader(catalog_file)
+            for row in rows:
+                catalog.add(row['uri'], row.get('title', ''), row.get('artist', ''), row.get('album', ''), row.get('album_uri', ''), row.get('artist_uri', ''))
+        print('Loaded catalog of', len(catalog.rows), 'tracks,', len(catalog.albums), 'albums and', len(catalog.artists), 'artists')
+        return catalog
+
+    def add(self, uri, title, artist, album, album_uri='', artist_uri=''):
+        """
+        Adds a row to the catalog.
+        """
+        if uri.startswith('spotify:artist:'):
+            self.artists.setdefault(artist_key(artist or title), uri)
+            return
+        if uri.startswith('spotify:album:'):
+            self.albums.setdefault((artist_key(artist), album_key(album or title)), uri)
+            return
+
+        row = len(self.rows)
+        self.rows.append((uri, sys.intern(title), sys.intern(artist), sys.intern(album), album_uri or None))
+        for word in set(title_key(title).split()):
+            self.words.setdefault(word, []).append(row)
+        if album_uri:
+            self.albums.setdefault((artist_key(artist), album_key(album)), album_uri)
+            self.tracks_by_album.setdefault(album_uri, []).append(row)
+        if artist_uri:
+            self.artists.setdefault(artist_key(artist), artist_uri)
+
+    def find_song(self, title, artist, album):
+        """
+        Finds the uri of a track, preferring one from the same album.
+        """
+        wanted = title_key(title)
+        words = wanted.split()
+        rows = None
+        # Start from the rarest word, every candidate has to have all of them
+        for word in sorted(words, key=lambda w: len(self.words.get(w, ()))):
+            found = self.words.get(word)
+            if found is None:
+                return self.miss()
+            rows = set(found) if rows is None else rows.intersection(found)
+            if len(rows) == 0:
+                return self.miss()
+        if rows is None:
+            return self.miss()
+
+        best = None
+        for row in sorted(rows):
+            uri, row_title, row_artist, row_album, album_uri = self.rows[row]
+            if title_key(row_title) != wanted or artist_key(row_artist) != artist_key(artist):
+                continue
+            if album_key(row_album) == album_key(album):
+                best = uri
+                break
+            if best is None:
+                best = uri
+        return self.hit(best) if best is not None else self.miss()
+
+    def find_album(self, artist, album):
+        """
+        Finds the uri of an album.
+        """
+        uri = self.albums.get((artist_key(artist), album_key(album)))
+        return self.hit(uri) if uri is not None else self.miss()
+
+    def find_artist(self, artist):
+        """
+        Finds the uri of an artist.
+        """
+        uri = self.artists.get(artist_key(artist))
+        return self.hit(uri) if uri is not None else self.miss()
+
+    def get_album_tracks(self, album_uri):
+        """
+        Gets the tracks of an album, when the catalog has them.
+            return: list of { 'uri', 'name' }, or None
+        """
+        rows = self.tracks_by_album.get(album_uri)
+        if rows is None:
+            return None
+        return [{ 'uri' : self.rows[row][0], 'name' : self.rows[row][1] } for row in rows]
+
+    def hit(self, uri):
+        self.hits += 1
+        return uri
+
+    def miss(self):
+        self.misses += 1
+        return None
+
+    def stats(self):
+        """
+        A one line summary of how much the catalog answered.
+        """
+        return 'Catalog: %d matched, %d left for Spotify' % (self.hits, self.misses)
+
+def load_catalog():
+    """
+    Loads the catalog named by SPOTIFY_CATALOG, if there is one.
+    """
+    path = os.getenv('SPOTIFY_CATALOG')
+    if not path:
+        return None
+    return Catalog.load(path)
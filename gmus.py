@@ -1,17 +1,31 @@
 import os
+import datetime
 from gmusicapi import Mobileclient
 import pickle
 
+from track import Track
+
 class GMusicClient:
-    def __init__(self):
+    def __init__(self, api=None, refresh=False):
         """
         This connects to the google music server by requesting credentials.
+        A stand in for the Mobileclient can be passed as api instead. With
+        refresh, the cached library and playlists are brought up to date.
         """
+        # username = input('Type your Google Play Music email below.\n--> ')
+        self.username = os.getenv('GOOGLE_USERNAME') or ''
+        self.refresh = refresh
+        cache_prefix = os.path.dirname(os.path.realpath(__file__)) + '/.cache-'
+        user = ''.join(filter(str.isalpha, self.username))
+        self.library_cache = LibraryCache(cache_prefix + 'lib_cache-' + user)
+        self.playlists_cache = PlaylistsCache(cache_prefix + 'playlists_cache-' + user)
+
+        if api is not None:
+            self.api = api
+            return
         self.api = Mobileclient()
 
-        # username = input('Type your Google Play Music email below.\n--> ')
-        self.username = os.getenv('GOOGLE_USERNAME')
-        dir_path = os.path.dirname(os.path.realpath(__file__)) + '/.cache-gmusic-' + ''.join(filter(str.isalpha, self.username))
+        dir_path = cache_prefix + 'gmusic-' + user
         # Check if already authenticated
         if(not os.path.isfile(dir_path)):
             self.api.perform_oauth(open_browser=True, storage_filepath=dir_path)
@@ -30,37 +44,189 @@ class GMusicClient:
         Gets all the playlists in Google Play Music. Some may not actually
         have any music, but they will be processed anyways.
         """
-        playlists_cache_path = os.path.dirname(os.path.realpath(__file__)) + '/.cache-playlists_cache-' + ''.join(filter(str.isalpha, self.username))
-        if (os.path.isfile(playlists_cache_path)):
-            with open(playlists_cache_path, 'rb') as playlists_cache_file:
-                playlists = pickle.load(playlists_cache_file)
-        else:
-            print('Requesting Google playlists')
-            playlistsG = self.api.get_all_user_playlist_contents()
-            print('Received Google playlists, we have', len(playlistsG), 'playlists')
-            playlists = Playlists(playlistsG)
-            with open(playlists_cache_path, 'wb') as playlists_cache_file:
-                pickle.dump(playlists, playlists_cache_file)
-
-        return playlists
+        cache = self.playlists_cache
+        if not cache.load():
+            cache.fetch(self.api)
+        elif self.refresh:
+            cache.refresh(self.api)
+        return cache.playlists
 
     def get_all_songs(self):
         """
         Gets the entire Google library for adding to the
         """
-        lib_cache_path = os.path.dirname(os.path.realpath(__file__)) + '/.cache-lib_cache-' + ''.join(filter(str.isalpha, self.username))
-        if (os.path.isfile(lib_cache_path)):
-            with open(lib_cache_path, 'rb') as lib_cache_file:
-                library = pickle.load(lib_cache_file)
+        cache = self.library_cache
+        if not cache.load():
+            cache.fetch(self.api)
+        elif self.refresh:
+            cache.refresh(self.api)
+        return MusicLibrary(cache.tracks())
+
+    def count_songs(self):
+        """
+        How many songs the library has, once get_all_songs has read it.
+        """
+        if self.library_cache.songs is None:
+            return None
+        return len(self.library_cache.songs)
+
+class LibraryCache:
+    """
+    LibraryCache keeps the Google library on disk between runs, along with
+    when each song last changed, so it can be brought up to date by asking
+    Google only for what changed since.
+    """
+    version = 2
+
+    def __init__(self, path):
+        self.path = path
+        self.songs = None
+        self.updated = 0 # Microseconds, like Google's lastModifiedTimestamp
+
+    def load(self):
+        """
+        Reads the cache, only the first time it is needed.
+            return: False if there is no usable cache
+        """
+        if self.songs is not None:
+            return True
+        loaded = load_versioned(self.path, self.version)
+        if loaded is None:
+            return False
+        self.updated, self.songs = loaded
+        return True
+
+    def fetch(self, api):
+        """
+        Downloads the whole library, a page at a time.
+        """
+        print('Requesting Google library')
+        self.songs = {}
+        self.updated = 0
+        for page in api.get_all_songs(incremental=True):
+            for song in page:
+                self.update(song)
+        print('Received Google library, we have', len(self.songs), 'songs')
+        self.save()
+
+    def refresh(self, api):
+        """
+        Downloads only the songs that changed (or were deleted) since the
+        cache was last updated.
+        """
+        since = datetime.datetime.fromtimestamp(self.updated / 1000000, tz=datetime.timezone.utc)
+        try:
+            pages = api.get_all_songs(incremental=True, include_deleted=True, updated_after=since)
+        except TypeError:
+            # Older gmusicapi can't ask for only the changes
+            return self.fetch(api)
+
+        changed = 0
+        for page in pages:
+            for song in page:
+                if self.update(song):
+                    changed += 1
+        print('Refreshed Google library,', changed, 'songs changed')
+        if changed > 0:
+            self.save()
+
+    def update(self, song):
+        """
+        Stores a song from Google if it is newer than what we have.
+            return: True if it changed anything
+        """
+        modified = int(song.get('lastModifiedTimestamp', 0))
+        cached = self.songs.get(song['id'])
+        if cached is not None and cached[0] == modified:
+            return False
+        self.songs[song['id']] = (modified, Track.from_gmusic(song))
+        self.updated = max(self.updated, modified)
+        return True
+
+    def tracks(self):
+        return [track for modified, track in self.songs.values()]
+
+    def save(self):
+        save_versioned(self.path, self.version, (self.updated, self.songs))
+
+class PlaylistsCache:
+    """
+    PlaylistsCache keeps the Google playlists on disk between runs. Google
+    can't send just the playlist entries that changed, so a refresh checks
+    when each playlist last changed and only downloads them all again if
+    any did.
+    """
+    version = 2
+
+    def __init__(self, path):
+        self.path = path
+        self.stamps = None
+        self.playlists = None
+
+    def load(self):
+        """
+        Reads the cache, only the first time it is needed.
+            return: False if there is no usable cache
+        """
+        if self.playlists is not None:
+            return True
+        loaded = load_versioned(self.path, self.version)
+        if loaded is None:
+            return False
+        self.stamps, self.playlists = loaded
+        return True
+
+    def fetch(self, api):
+        """
+        Downloads every playlist with its songs.
+        """
+        print('Requesting Google playlists')
+        self.stamps = playlist_stamps(api)
+        playlistsG = api.get_all_user_playlist_contents()
+        print('Received Google playlists, we have', len(playlistsG), 'playlists')
+        self.playlists = Playlists(playlistsG)
+        save_versioned(self.path, self.version, (self.stamps, self.playlists))
+
+    def refresh(self, api):
+        """
+        Downloads the playlists again if any of them changed.
+        """
+        if playlist_stamps(api) != self.stamps:
+            self.fetch(api)
         else:
-            print('Requesting Google library')
-            librarySongs = self.api.get_all_songs()
-            print('Received Google library, we have', len(librarySongs), 'songs')
-            library = MusicLibrary(librarySongs)
-            with open(lib_cache_path, 'wb') as lib_cache_file:
-                pickle.dump(library, lib_cache_file)
+            print('Google playlists are unchanged')
 
-        return library
+def playlist_stamps(api):
+    """
+    Gets when each of the user's playlists last changed.
+    """
+    stamps = {}
+    for page in api.get_all_playlists(incremental=True):
+        for plist in page:
+            stamps[plist['id']] = plist.get('lastModifiedTimestamp')
+    return stamps
+
+def load_versioned(path, version):
+    """
+    Loads something saved by save_versioned, or None if it is missing or
+    from another version.
+    """
+    if not os.path.isfile(path):
+        return None
+    try:
+        with open(path, 'rb') as cache_file:
+            loaded = pickle.load(cache_file)
+    except (OSError, EOFError, AttributeError, ValueError, pickle.UnpicklingError):
+        return None
+    # Caches from before versioning were a bare MusicLibrary or Playlists
+    if not isinstance(loaded, tuple) or len(loaded) != 2 or loaded[0] != version:
+        return None
+    return loaded[1]
+
+def save_versioned(path, version, data):
+    with open(path + '.tmp', 'wb') as cache_file:
+        pickle.dump((version, data), cache_file, pickle.HIGHEST_PROTOCOL)
+    os.replace(path + '.tmp', path)
 
 class Playlists:
     """
@@ -83,7 +249,7 @@ class Playlists:
         """
         Sets the index to start reading the library from.
         """
-        self.index = i
+        self.p_index = i
 
     def __iter__(self):
         """
@@ -116,7 +282,7 @@ class Playlist:
         for t in plist['tracks']:
             # Ensures that the track has info attached
             if('track' in t):
-                self.tracks.append(t['track'])
+                self.tracks.append(Track.from_gmusic(t['track']))
         self.index = 0
 
     def get_name(self):
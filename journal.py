@@ -0,0 +1,98 @@
+import os
+import json
+import threading
+
+class Journal:
+    """
+    Journal is an append-only record of a run: which items were resolved
+    (and to what) and which writes made it to Spotify. If a run stops half
+    way, the next one can be started with --resume and picks up from the
+    journal without searching or writing the same things again.
+    """
+    def __init__(self, name, resume=False):
+        """
+        Opens the journal for an action. Without resume any old journal is
+        discarded and a new one started.
+        """
+        self.path = '.journal-' + name + '.jsonl'
+        self.resolved = {}
+        self.committed = {}
+        self.finished = set()
+        self.lock = threading.Lock()
+
+        if resume and os.path.isfile(self.path):
+            line = '\n'
+            with open(self.path) as journal_file:
+                for line in journal_file:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # The last line may be cut short if we were killed while writing it
+                        continue
+                    if 'resolved' in entry:
+                        self.resolved[json.dumps(entry['resolved'])] = entry['uri']
+                    elif 'committed' in entry:
+                        self.committed.setdefault(entry['committed'], set()).update(entry['uris'])
+                    elif 'finished' in entry:
+                        self.finished.add(entry['finished'])
+            print('Resuming with', len(self.resolved), 'resolved and', sum(len(u) for u in self.committed.values()), 'written')
+            self.file = open(self.path, 'a')
+            if not line.endswith('\n'):
+                self.file.write('\n')
+        else:
+            self.file = open(self.path, 'w')
+
+    def write(self, entry):
+        with self.lock:
+            self.file.write(json.dumps(entry) + '\n')
+            self.file.flush()
+
+    def lookup(self, key, find):
+        """
+        Gets the uri for key from the journal, or calls find() and records
+        what it returns.
+        """
+        k = json.dumps(key)
+        if k in self.resolved:
+            return self.resolved[k]
+        uri = find()
+        self.resolve(key, uri)
+        return uri
+
+    def has(self, key):
+        return json.dumps(key) in self.resolved
+
+    def get(self, key):
+        return self.resolved[json.dumps(key)]
+
+    def resolve(self, key, uri):
+        """
+        Records what key was resolved to (None for not found).
+        """
+        with self.lock:
+            self.resolved[json.dumps(key)] = uri
+        self.write({ 'resolved' : key, 'uri' : uri })
+
+    def commit(self, target, uris):
+        """
+        Records that uris were written to target.
+        """
+        with self.lock:
+            self.committed.setdefault(target, set()).update(uris)
+        self.write({ 'committed' : target, 'uris' : list(uris) })
+
+    def is_committed(self, target, uri):
+        return uri in self.committed.get(target, ())
+
+    def finish(self, target):
+        """
+        Records that target is completely done.
+        """
+        self.finished.add(target)
+        self.write({ 'finished' : target })
+
+    def is_finished(self, target):
+        return target in self.finished
+
+    def close(self):
+        self.file.close()
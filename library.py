@@ -0,0 +1,49 @@
+import normalize
+
+class LibraryIndex:
+    """
+    LibraryIndex picks out the artists and albums worth migrating as the
+    library streams through it: those with a track that is still in the
+    library and has been played (or whose play count isn't used). Only their keys are kept, not the tracks,
+    so memory grows with the number of artists and albums, not of songs.
+    """
+    def __init__(self, tracks=()):
+        """
+        Creates an index, adding all the tracks given.
+        """
+        self.artists = set()
+        self.albums = set()
+        for track in tracks:
+            self.add(track)
+
+    @staticmethod
+    def artist_key(track):
+        return normalize.artist_key(track.artist)
+
+    @staticmethod
+    def album_key(track):
+        return (normalize.artist_key(track.artist), normalize.album_key(track.album))
+
+    @staticmethod
+    def song_key(track):
+        return (normalize.artist_key(track.artist), normalize.album_key(track.album), normalize.title_key(track.title))
+
+    def add(self, track):
+        """
+        Adds a track to the index.
+            return: (artist, album), each True if the track made its artist
+            or album worth migrating for the first time
+        """
+        if track.deleted or track.play_count == 0:
+            return (False, False)
+        return (first(self.artists, self.artist_key(track)), first(self.albums, self.album_key(track)))
+
+def first(keys, key):
+    """
+    Adds key to a set.
+        return: True if it wasn't there yet
+    """
+    if key in keys:
+        return False
+    keys.add(key)
+    return True
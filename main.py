@@ -1,12 +1,16 @@
-from actions import *
+import actions
 import argparse
 from dotenv import load_dotenv
 
 load_dotenv()
 
 parser = argparse.ArgumentParser(description='Gooify.')
-parser.add_argument('action', nargs='?', help='action to perform (albums|artists|playlists)')
+parser.add_argument('action', nargs='?', help='action to perform (albums|artists|playlists|all)')
 parser.add_argument('--add', action='store_true')
+parser.add_argument('--sync', action='store_true', help='only change what differs in existing playlists')
+parser.add_argument('--resume', action='store_true', help='carry on from where the last run of this action stopped')
+parser.add_argument('--refresh', action='store_true', help='fetch what changed in the Google library since it was cached')
+parser.add_argument('--workers', type=int, default=1, help='number of searches to run at once')
 args = parser.parse_args()
 
 if args.add:
@@ -14,12 +18,15 @@ if args.add:
 
 if args.action == 'albums':
     print("albums!")
-    albums(args.add)
+    actions.albums(args.add, args.workers, args.resume, args.refresh)
 elif args.action == 'artists':
     print("artists!")
-    artists(args.add)
+    actions.artists(args.add, args.workers, args.resume, args.refresh)
 elif args.action == 'playlists':
     print("playlists!")
-    playlists(args.add)
+    actions.playlists(args.add, args.workers, args.sync, args.resume, args.refresh)
+elif args.action == 'all':
+    print("all!")
+    actions.everything(args.add, args.workers, args.sync, args.resume, args.refresh)
 else:
     print('You must specify an action')
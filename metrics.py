@@ -0,0 +1,315 @@
+"""
+Keeps track of where a run spends its time: how many requests each Spotify
+endpoint got and how long they took, how long reading the Google library
+took, how many items went through and how fast. A live progress line shows
+it while running, and with METRICS_FILE set it is all written out at the end,
+as JSON or (for a .prom file) in Prometheus' text format.
+"""
+
+import os
+import sys
+import json
+import time
+import threading
+from bisect import bisect_left
+from collections import Counter
+
+# Upper bounds (in seconds) of the request latency histogram's buckets
+BUCKETS = (0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float('inf'))
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.endpoints = {}
+        self.sources = {}
+        self.actions = {}
+        self.gauges = {}
+
+    def timed(self, endpoint, fn):
+        """
+        Wraps fn so every call to it is timed and counted as a request to
+        the endpoint.
+        """
+        def call(*args, **kwargs):
+            start = time.perf_counter()
+            error = None
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                error = e
+                raise
+            finally:
+                self.record(endpoint, time.perf_counter() - start, error)
+        return call
+
+    def record(self, endpoint, seconds, error=None):
+        with self.lock:
+            stats = self.endpoints.get(endpoint)
+            if stats is None:
+                stats = self.endpoints[endpoint] = Endpoint()
+            stats.record(seconds, error)
+
+    def source(self, name, load):
+        """
+        Times reading from a source: calling load() and then going through
+        the items it returns, which are passed on as they come.
+        """
+        start = time.perf_counter()
+        items = load()
+        self.add_source(name, time.perf_counter() - start, 0)
+        return self.timed_items(name, items)
+
+    def timed_items(self, name, items):
+        items = iter(items)
+        seconds = 0.0
+        count = 0
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    item = next(items)
+                except StopIteration:
+                    return
+                finally:
+                    seconds += time.perf_counter() - start
+                count += 1
+                # Only take the lock now and then, sources can be very long
+                if count % 1000 == 0:
+                    self.add_source(name, seconds, count)
+                    seconds = 0.0
+                    count = 0
+                yield item
+        finally:
+            self.add_source(name, seconds, count)
+
+    def add_source(self, name, seconds, count):
+        with self.lock:
+            stats = self.sources.setdefault(name, { 'seconds' : 0.0, 'items' : 0 })
+            stats['seconds'] += seconds
+            stats['items'] += count
+
+    def watch(self, name, read):
+        """
+        Adds numbers kept elsewhere (like the search cache's hits) to the
+        metrics. read() returns a dict of them.
+        """
+        self.gauges[name] = read
+
+    def progress(self, name, total=None, unit='tracks'):
+        """
+        Starts a live progress line for an action.
+        """
+        progress = Progress(self, name, total, unit)
+        self.actions[name] = progress
+        return progress
+
+    def requests(self):
+        """
+        How many requests were made and how many were throttled.
+        """
+        with self.lock:
+            calls = sum(e.calls for e in self.endpoints.values())
+            throttled = sum(e.errors.get('429', 0) for e in self.endpoints.values())
+        return (calls, throttled)
+
+    def summary(self):
+        """
+        A short summary of how Spotify is treating us, for the progress line.
+        """
+        calls, throttled = self.requests()
+        text = '%d requests, %d throttled' % (calls, throttled)
+        if 'rate_limiter' in self.gauges:
+            text += ', %.1fs backing off' % self.gauges['rate_limiter']()['backoff_seconds']
+        if 'search_cache' in self.gauges:
+            cache = self.gauges['search_cache']()
+            total = cache['hits'] + cache['misses']
+            if total > 0:
+                text += ', cache %.0f%% hits' % (100.0 * cache['hits'] / total)
+        return text
+
+    def stats(self):
+        """
+        A one line summary of the requests made, busiest endpoint first.
+        """
+        with self.lock:
+            endpoints = sorted(self.endpoints.items(), key=lambda e: -e[1].calls)
+            calls = sum(e.calls for name, e in endpoints)
+            seconds = sum(e.seconds for name, e in endpoints)
+            by_endpoint = ', '.join('%s %d' % (name, e.calls) for name, e in endpoints)
+        mean = 1000.0 * seconds / calls if calls else 0.0
+        return 'Requests: %d (%s), %.0fms on average' % (calls, by_endpoint or 'none', mean)
+
+    def snapshot(self):
+        """
+        Everything measured so far, as a dict that can be written as JSON.
+        """
+        with self.lock:
+            snapshot = {
+                'seconds' : time.monotonic() - self.started,
+                'endpoints' : { name : e.to_dict() for name, e in self.endpoints.items() },
+                'sources' : { name : dict(s) for name, s in self.sources.items() },
+            }
+        snapshot['actions'] = { name : p.to_dict() for name, p in self.actions.items() }
+        for name, read in self.gauges.items():
+            snapshot[name] = read()
+        return snapshot
+
+    def prometheus(self):
+        """
+        Everything measured so far in Prometheus' text format.
+        """
+        snapshot = self.snapshot()
+        lines = []
+        def metric(name, type, help, samples):
+            lines.append('# HELP gooify_%s %s' % (name, help))
+            lines.append('# TYPE gooify_%s %s' % (name, type))
+            for labels, value in samples:
+                label_text = ','.join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in labels)
+                lines.append('gooify_%s%s %s' % (name, '{' + label_text + '}' if label_text else '', format_value(value)))
+
+        endpoints = snapshot['endpoints']
+        metric('requests_total', 'counter', 'Requests made to Spotify.',
+               [((('endpoint', name),), e['calls']) for name, e in endpoints.items()])
+        metric('request_errors_total', 'counter', 'Requests to Spotify that failed, by status.',
+               [((('endpoint', name), ('status', status)), n) for name, e in endpoints.items() for status, n in e['errors'].items()])
+        lines.append('# HELP gooify_request_seconds How long requests to Spotify took.')
+        lines.append('# TYPE gooify_request_seconds histogram')
+        for name, e in endpoints.items():
+            cumulative = 0
+            for bound, n in zip(BUCKETS, e['buckets']):
+                cumulative += n
+                lines.append('gooify_request_seconds_bucket{endpoint="%s",le="%s"} %d' % (name, '+Inf' if bound == float('inf') else bound, cumulative))
+            lines.append('gooify_request_seconds_sum{endpoint="%s"} %s' % (name, format_value(e['seconds'])))
+            lines.append('gooify_request_seconds_count{endpoint="%s"} %d' % (name, e['calls']))
+
+        sources = snapshot['sources']
+        metric('source_seconds', 'gauge', 'Time spent reading from Google.', [((('source', n),), s['seconds']) for n, s in sources.items()])
+        metric('source_items', 'gauge', 'Items read from Google.', [((('source', n),), s['items']) for n, s in sources.items()])
+        actions = snapshot['actions']
+        metric('action_items', 'gauge', 'Items an action went through.', [((('action', n),), a['items']) for n, a in actions.items()])
+        metric('action_items_per_second', 'gauge', 'How fast an action went through its items.',
+               [((('action', n),), a['per_second']) for n, a in actions.items()])
+        for gauge in self.gauges:
+            for key, value in snapshot[gauge].items():
+                metric(gauge + '_' + key, 'gauge', key.replace('_', ' ').capitalize() + ' (' + gauge.replace('_', ' ') + ').', [((), value)])
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, path):
+        """
+        Writes everything measured to path, in Prometheus' text format when
+        it ends with .prom and as JSON otherwise.
+        """
+        with open(path + '.tmp', 'w') as metrics_file:
+            if path.endswith('.prom'):
+                metrics_file.write(self.prometheus())
+            else:
+                json.dump(self.snapshot(), metrics_file, indent=2)
+        os.replace(path + '.tmp', path)
+
+class Endpoint:
+    """
+    How many requests went to one endpoint, how many failed (by status) and
+    a histogram of how long they took.
+    """
+    __slots__ = ('calls', 'errors', 'seconds', 'buckets')
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = Counter()
+        self.seconds = 0.0
+        self.buckets = [0] * len(BUCKETS)
+
+    def record(self, seconds, error):
+        self.calls += 1
+        self.seconds += seconds
+        self.buckets[bisect_left(BUCKETS, seconds)] += 1
+        if error is not None:
+            self.errors[str(getattr(error, 'http_status', None) or type(error).__name__)] += 1
+
+    def to_dict(self):
+        return { 'calls' : self.calls, 'errors' : dict(self.errors), 'seconds' : self.seconds,
+                 'mean_seconds' : self.seconds / self.calls if self.calls else 0.0, 'buckets' : list(self.buckets),
+                 'bucket_bounds' : [b if b != float('inf') else '+Inf' for b in BUCKETS] }
+
+class Progress:
+    """
+    A progress line for an action, redrawn every second on a terminal (and
+    written every 30 seconds otherwise): how far it got, how fast it is
+    going, when it should be done and how Spotify is treating us.
+    """
+    def __init__(self, metrics, name, total=None, unit='tracks', stream=None):
+        self.metrics = metrics
+        self.name = name
+        self.total = total
+        self.unit = unit
+        self.stream = stream or sys.stderr
+        self.done = 0
+        self.started = time.monotonic()
+        self.finished = None
+        self.tty = self.stream.isatty()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def step(self, n=1):
+        self.done += n
+
+    def run(self):
+        while not self.stopped.wait(1.0 if self.tty else 30.0):
+            self.draw()
+
+    def draw(self, end=''):
+        if self.tty:
+            self.stream.write('\r\033[K' + self.line() + end)
+        else:
+            self.stream.write(self.line() + '\n')
+        self.stream.flush()
+
+    def line(self):
+        seconds = self.seconds()
+        rate = self.done / seconds if seconds > 0 else 0.0
+        if self.total:
+            text = '%s: %d/%d %s (%.1f%%)' % (self.name, self.done, self.total, self.unit, 100.0 * self.done / self.total)
+        else:
+            text = '%s: %d %s' % (self.name, self.done, self.unit)
+        text += ', %.1f/s' % rate
+        if self.finished is not None:
+            text += ', took ' + duration(seconds)
+        elif self.total and rate > 0:
+            text += ', ETA ' + duration(max(0, self.total - self.done) / rate)
+        return text + ' | ' + self.metrics.summary()
+
+    def seconds(self):
+        return (self.finished or time.monotonic()) - self.started
+
+    def close(self):
+        """
+        Stops updating and leaves the final line, if it wasn't closed already.
+        """
+        if self.finished is not None:
+            return
+        self.finished = time.monotonic()
+        self.stopped.set()
+        self.thread.join()
+        self.draw('\n')
+
+    def to_dict(self):
+        seconds = self.seconds()
+        return { 'items' : self.done, 'total' : self.total, 'unit' : self.unit, 'seconds' : seconds,
+                 'per_second' : self.done / seconds if seconds > 0 else 0.0 }
+
+def duration(seconds):
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return '%dh%02dm' % (seconds // 3600, seconds % 3600 // 60)
+    if seconds >= 60:
+        return '%dm%02ds' % (seconds // 60, seconds % 60)
+    return '%ds' % seconds
+
+def format_value(value):
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
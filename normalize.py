@@ -0,0 +1,114 @@
+"""
+Turns artist, album and track names into canonical keys, so the same thing
+spelt slightly differently (case, accents, punctuation, "feat." credits,
+deluxe editions and remasters) is only searched for, cached and migrated
+once. Also cleans names up for use in Spotify search queries.
+
+Everything is memoized, libraries repeat the same names a lot.
+"""
+
+import re
+import unicodedata
+from functools import lru_cache
+
+# "Song (feat. X)", "Song [with X]"
+_featuring_bracketed = re.compile(r'\s*[\(\[]\s*(?:feat|ft|featuring|with)\b\.?[^\)\]]*[\)\]]', re.IGNORECASE)
+# "Song feat. X", "Artist ft X"
+_featuring = re.compile(r'\s+(?:feat|ft|featuring)\b\.?\s.*$', re.IGNORECASE)
+
+_album_words = r'(?:deluxe|edition|remaster(?:ed)?|expanded|anniversary|bonus|special|version|reissue|mono|stereo)'
+_title_words = r'(?:remaster(?:ed)?|mono|stereo)'
+# "Album (Deluxe Edition)", "Album [2011 Remaster]", "Album - Remastered"
+_album_suffix = re.compile(r'\s*(?:[\(\[][^\)\]]*\b' + _album_words + r'\b[^\)\]]*[\)\]]|\s-\s[^-]*\b' + _album_words + r'\b.*$)', re.IGNORECASE)
+_title_suffix = re.compile(r'\s*(?:[\(\[][^\)\]]*\b' + _title_words + r'\b[^\)\]]*[\)\]]|\s-\s[^-]*\b' + _title_words + r'\b.*$)', re.IGNORECASE)
+
+_apostrophes = re.compile(r"['’`]")
+_not_word = re.compile(r'[\W_]+')
+# Characters that upset Spotify's search syntax
+_query_table = dict.fromkeys(map(ord, ';/"()[]&'), ' ')
+_and = re.compile(r'\band\b', re.IGNORECASE)
+
+@lru_cache(maxsize=65536)
+def fold(text):
+    """
+    Case folds, strips accents and turns punctuation into single spaces.
+    """
+    text = unicodedata.normalize('NFKD', text)
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    text = _apostrophes.sub('', text.casefold().replace('&', ' and '))
+    return ' '.join(_not_word.sub(' ', text).split())
+
+def strip_featuring(name):
+    """
+    Removes featured artist credits.
+    """
+    return _featuring.sub('', _featuring_bracketed.sub('', name)).strip() or name
+
+def strip_edition(album):
+    """
+    Removes deluxe edition, remaster and similar suffixes from an album.
+    """
+    stripped = album
+    while True:
+        shorter = _album_suffix.sub('', stripped).strip()
+        if shorter == stripped or shorter == '':
+            return stripped
+        stripped = shorter
+
+def strip_remaster(title):
+    """
+    Removes remaster suffixes from a track title. Live versions and remixes
+    are different recordings, so those stay.
+    """
+    stripped = _title_suffix.sub('', title).strip()
+    return stripped or title
+
+@lru_cache(maxsize=65536)
+def artist_key(artist):
+    return fold(strip_featuring(artist))
+
+@lru_cache(maxsize=65536)
+def album_key(album):
+    return fold(strip_edition(album))
+
+@lru_cache(maxsize=65536)
+def title_key(title):
+    return fold(strip_remaster(strip_featuring(title)))
+
+@lru_cache(maxsize=65536)
+def query(text):
+    """
+    Cleans up a name to go in a search query.
+    """
+    return ' '.join(_apostrophes.sub('', text).translate(_query_table).split())
+
+@lru_cache(maxsize=65536)
+def artist_query(artist):
+    # The "and" in "X and Y" rarely matches how Spotify names the artist
+    return ' '.join(_and.sub(' ', query(strip_featuring(artist))).split()) or query(artist)
+
+@lru_cache(maxsize=65536)
+def album_query(album):
+    return query(strip_edition(album))
+
+@lru_cache(maxsize=65536)
+def title_query(title):
+    return query(strip_remaster(strip_featuring(title)))
+
+def track_search(trackname, artistname, albumname):
+    """
+    The Spotify search for a song.
+    """
+    return "track:" + title_query(trackname) + " artist:" + artist_query(artistname) + " album:" + album_query(albumname)
+
+def album_search(artistname, albumname):
+    """
+    The Spotify search for an album.
+    """
+    return "artist:" + artist_query(artistname) + " album:" + album_query(albumname)
+
+def artist_search(artistname):
+    """
+    The Spotify search for an artist.
+    """
+    return "artist:" + artist_query(artistname)
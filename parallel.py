@@ -0,0 +1,23 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+def imap(fn, items, workers, ahead=4):
+    """
+    Like map, but runs fn on a pool of workers. Results come back in the
+    same order as items, and only workers * ahead items are read ahead of
+    the one being waited on, so items can be a generator that never fits
+    in memory at once.
+    """
+    if workers <= 1:
+        for item in items:
+            yield fn(item)
+        return
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for item in items:
+            pending.append(pool.submit(fn, item))
+            if len(pending) >= workers * ahead:
+                yield pending.popleft().result()
+        while len(pending) > 0:
+            yield pending.popleft().result()
@@ -0,0 +1,52 @@
+import queue
+import threading
+
+# How many items can wait between two stages
+BUFFER = 1000
+
+_done = object()
+
+class _Failed:
+    def __init__(self, error):
+        self.error = error
+
+def buffered(items, size=BUFFER):
+    """
+    Reads items on a thread of its own, handing them over through a queue
+    of at most size items. Whatever produces the items keeps working while
+    we're busy with earlier ones, but never gets more than size ahead.
+    Errors are raised where the items are read.
+    """
+    handoff = queue.Queue(size)
+
+    def produce():
+        try:
+            for item in items:
+                handoff.put(item)
+        except BaseException as e:
+            handoff.put(_Failed(e))
+            return
+        handoff.put(_done)
+
+    threading.Thread(target=produce, daemon=True).start()
+    while True:
+        item = handoff.get()
+        if item is _done:
+            return
+        if isinstance(item, _Failed):
+            raise item.error
+        yield item
+
+def pipeline(source, stages, size=BUFFER):
+    """
+    Connects a source to a chain of stages, each running on its own thread
+    with a bounded buffer in front of it, so memory stays flat however big
+    the source is and every stage works at the same time as the others.
+    A stage is a function that takes an iterator of items and returns an
+    iterator of items (usually a generator). The output of the last stage
+    is returned in order.
+    """
+    items = buffered(source, size)
+    for stage in stages:
+        items = buffered(stage(items), size)
+    return items
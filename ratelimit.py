@@ -0,0 +1,113 @@
+import os
+import random
+import threading
+import time
+
+class RateLimiter:
+    """
+    RateLimiter is a token bucket shared by every call we make to an API.
+    It spaces requests out, limits how many run at once, and when the server
+    starts throttling it backs off and slows down (then speeds up again
+    slowly) so we hover just under the limit instead of hitting it in bursts.
+    """
+    def __init__(self, rate=None, burst=None, concurrency=None, max_retries=None):
+        """
+        rate is the most requests per second we will ever make, burst is how
+        many can go out back to back, and concurrency how many can be in
+        flight at once.
+        """
+        self.max_rate = rate if rate is not None else float(os.getenv('SPOTIFY_RATE_LIMIT', '10'))
+        self.burst = burst if burst is not None else max(1.0, self.max_rate)
+        self.max_concurrency = concurrency if concurrency is not None else int(os.getenv('SPOTIFY_MAX_CONCURRENCY', '8'))
+        self.max_retries = max_retries if max_retries is not None else int(os.getenv('SPOTIFY_MAX_RETRIES', '8'))
+        self.min_rate = min(0.5, self.max_rate)
+
+        self.rate = self.max_rate
+        self.tokens = self.burst
+        self.refilled = time.monotonic()
+        self.concurrency = self.max_concurrency
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.successes = 0
+        self.throttled = 0
+        self.backoff_time = 0.0
+
+        self.lock = threading.Condition()
+
+    def acquire(self):
+        """
+        Waits until a request may go out.
+        """
+        with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.refilled) * self.rate)
+                self.refilled = now
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                elif self.in_flight >= self.concurrency:
+                    wait = None
+                elif self.tokens < 1:
+                    wait = (1 - self.tokens) / self.rate
+                else:
+                    self.tokens -= 1
+                    self.in_flight += 1
+                    return
+                self.lock.wait(wait)
+
+    def release(self, throttled=False, retry_after=None, attempt=0):
+        """
+        Gives back a slot after a request. When it was throttled, everyone
+        waits for retry_after seconds if the server told us how long,
+        otherwise for an exponential backoff with jitter, and the rate and
+        concurrency are cut. Successes slowly win them back.
+        """
+        with self.lock:
+            self.in_flight -= 1
+            if throttled:
+                self.throttled += 1
+                self.successes = 0
+                self.rate = max(self.min_rate, self.rate * 0.7)
+                self.concurrency = max(1, self.concurrency // 2)
+                if retry_after is None:
+                    retry_after = random.uniform(0, min(60.0, 0.5 * (2 ** attempt)))
+                until = time.monotonic() + retry_after
+                if until > self.paused_until:
+                    self.backoff_time += until - max(self.paused_until, time.monotonic())
+                    self.paused_until = until
+                self.tokens = 0
+            else:
+                self.successes += 1
+                self.rate = min(self.max_rate, self.rate + self.max_rate / 100)
+                if self.successes % 20 == 0 and self.concurrency < self.max_concurrency:
+                    self.concurrency += 1
+            self.lock.notify_all()
+
+    def call(self, throttled, fn, *args, **kwargs):
+        """
+        Calls fn through the limiter, retrying while it is throttled.
+        throttled(e) looks at an exception and returns False when it should
+        just be raised, or True (or the number of seconds the server asked us
+        to wait) when the call should be tried again.
+        """
+        attempt = 0
+        while True:
+            self.acquire()
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                retry = throttled(e)
+                if retry is False or attempt >= self.max_retries:
+                    self.release()
+                    raise
+                self.release(True, None if retry is True else retry, attempt)
+                attempt += 1
+                continue
+            self.release()
+            return result
+
+    def stats(self):
+        """
+        A one line summary of how much we were throttled.
+        """
+        return 'Rate limiter: %d throttled requests, %.1fs backing off, settled at %.1f req/s' % (self.throttled, self.backoff_time, self.rate)
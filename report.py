@@ -0,0 +1,182 @@
+"""
+The match report: one record per item an action looked at, saying what it
+was (title, artist, album, playlist), what we searched for, what we matched
+it to, how sure we were and how long it took. Records are buffered and
+written in batches (on a thread of their own unless asked not to), as JSON
+lines or, for a .csv report, CSV.
+
+Run this file to look through a report:
+
+    python report.py report-albums.jsonl                      # summary of the last run
+    python report.py report-albums.jsonl --status unmatched   # what wasn't found
+"""
+
+import os
+import csv
+import sys
+import json
+import queue
+import datetime
+import argparse
+import threading
+from collections import Counter
+
+FIELDS = ['run', 'action', 'status', 'playlist', 'title', 'artist', 'album', 'query', 'uri', 'confidence', 'seconds', 'changes']
+
+# Records kept before they are handed over to be written
+BUFFER = 1000
+
+class Report:
+    def __init__(self, path, action, background=True, buffer=BUFFER):
+        """
+        Opens a report to add this run's records to.
+        """
+        self.path = path
+        self.action = action
+        self.run = datetime.datetime.now().isoformat(timespec='seconds')
+        self.buffer = buffer
+        self.pending = []
+        self.csv = path.endswith('.csv')
+        new = not os.path.isfile(path) or os.path.getsize(path) == 0
+        self.file = open(path, 'a', newline='', encoding='utf-8')
+        if self.csv:
+            self.writer = csv.DictWriter(self.file, FIELDS, extrasaction='ignore')
+            if new:
+                self.writer.writeheader()
+
+        self.queue = None
+        self.error = None
+        if background:
+            # A few batches can wait, after that adding records waits for the writer
+            self.queue = queue.Queue(4)
+            self.thread = threading.Thread(target=self.write_batches, daemon=True)
+            self.thread.start()
+
+    def write(self, status, **fields):
+        """
+        Adds a record. Fields that are None are left out.
+        """
+        record = { 'run' : self.run, 'action' : self.action, 'status' : status }
+        for key, value in fields.items():
+            if value is not None:
+                record[key] = value
+        self.pending.append(record)
+        if len(self.pending) >= self.buffer:
+            self.flush()
+
+    def section(self, action):
+        """
+        Gets a part of the report whose records say they come from action,
+        for runs that do several actions at once.
+        """
+        return Section(self, action)
+
+    def flush(self):
+        """
+        Hands the buffered records over to be written.
+        """
+        if len(self.pending) == 0:
+            return
+        records = self.pending
+        self.pending = []
+        if self.queue is not None:
+            self.queue.put(records)
+        else:
+            self.write_records(records)
+
+    def write_batches(self):
+        while True:
+            records = self.queue.get()
+            if records is None:
+                return
+            if self.error is not None:
+                continue
+            try:
+                self.write_records(records)
+            except Exception as e:
+                # Kept for close() to raise, the run carries on meanwhile
+                self.error = e
+
+    def write_records(self, records):
+        if self.csv:
+            self.writer.writerows(records)
+        else:
+            self.file.write(''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in records))
+
+    def close(self):
+        """
+        Writes out everything left and closes the report.
+        """
+        self.flush()
+        if self.queue is not None:
+            self.queue.put(None)
+            self.thread.join()
+        self.file.close()
+        if self.error is not None:
+            raise self.error
+
+class Section:
+    def __init__(self, report, action):
+        self.report = report
+        self.action = action
+
+    def write(self, status, **fields):
+        self.report.write(status, action=self.action, **fields)
+
+def read(path):
+    """
+    Reads the records in a report, one at a time.
+    """
+    with open(path, newline='', encoding='utf-8') as report_file:
+        if path.endswith('.csv'):
+            yield from csv.DictReader(report_file)
+            return
+        for line in report_file:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                # A run that was killed can leave half a line
+                continue
+
+def last_run(path, status=None):
+    """
+    Gets the records from the last run in a report (runs are appended one
+    after the other), only those with status if given.
+    """
+    records = []
+    run = None
+    for record in read(path):
+        if record.get('run') != run:
+            run = record.get('run')
+            records = []
+        if status is None or record.get('status') == status:
+            records.append(record)
+    return records
+
+def main():
+    parser = argparse.ArgumentParser(description='Summarises a match report, or lists the records in it.')
+    parser.add_argument('report', nargs='+', help='report files (report-<action>.jsonl or .csv)')
+    parser.add_argument('--status', help='list the records with this status, like unmatched')
+    parser.add_argument('--all', action='store_true', help='look at every run, not just the last one')
+    args = parser.parse_args()
+
+    for path in args.report:
+        if args.all:
+            records = [r for r in read(path) if args.status is None or r.get('status') == args.status]
+        else:
+            records = last_run(path, args.status)
+
+        if args.status is None:
+            counts = Counter((r.get('action'), r.get('status')) for r in records)
+            runs = sorted(set(r.get('run') for r in records))
+            print(path + ':', len(records), 'records from', ', '.join(runs) if len(runs) < 4 else '%d runs' % len(runs))
+            for (action, status), n in sorted(counts.items()):
+                print('  %-10s %-20s %d' % (action, status, n))
+            continue
+
+        out = csv.writer(sys.stdout, delimiter='\t', lineterminator='\n')
+        for record in records:
+            out.writerow([record.get(field, '') for field in FIELDS[2:]])
+
+if __name__ == '__main__':
+    main()
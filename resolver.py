@@ -0,0 +1,93 @@
+import time
+
+from parallel import imap
+from library import LibraryIndex
+from normalize import title_key
+
+class TrackResolver:
+    """
+    TrackResolver finds the Spotify uris for a batch of tracks. Tracks from
+    the same album are found with one album search and a look at its track
+    list, only the ones that can't be found that way are searched for one
+    by one.
+    """
+    def __init__(self, spot, workers=1, journal=None):
+        """
+        When a journal is given, songs already in it aren't searched again
+        and new results are recorded in it as they come in.
+        """
+        self.spot = spot
+        self.workers = workers
+        self.journal = journal
+        # Seconds it took to resolve each song (by song_key), shared out
+        # between the songs resolved together
+        self.seconds = {}
+
+    def match(self, songs, progress=None):
+        """
+        Resolves a list of songs, returning (song, uri) in the same order,
+        with uri None when it couldn't be found. Resolved songs are counted
+        on progress, if given.
+        """
+        albums = {}
+        for i, song in enumerate(songs):
+            albums.setdefault(LibraryIndex.album_key(song), []).append(i)
+
+        def resolve(indexes):
+            start = time.perf_counter()
+            found = self.resolve_album([songs[i] for i in indexes])
+            return (indexes, found, time.perf_counter() - start)
+
+        uris = [None] * len(songs)
+        for indexes, found, seconds in imap(resolve, albums.values(), self.workers):
+            for i, uri in zip(indexes, found):
+                uris[i] = uri
+                self.seconds[LibraryIndex.song_key(songs[i])] = seconds / len(indexes)
+                if self.journal is not None:
+                    self.journal.resolve(LibraryIndex.song_key(songs[i]), uri)
+            if progress is not None:
+                progress.step(len(indexes))
+        return list(zip(songs, uris))
+
+    def resolve(self, songs, progress=None):
+        """
+        Resolves every distinct song once, however many times it appears.
+            return: map of LibraryIndex.song_key to uri (or None)
+        """
+        resolved = {}
+        distinct = {}
+        for song in songs:
+            key = LibraryIndex.song_key(song)
+            if self.journal is not None and self.journal.has(key):
+                resolved[key] = self.journal.get(key)
+            else:
+                distinct.setdefault(key, song)
+        if progress is not None:
+            progress.total = len(resolved) + len(distinct)
+            progress.step(len(resolved))
+        found = self.match(list(distinct.values()), progress)
+        resolved.update((key, uri) for key, (song, uri) in zip(distinct.keys(), found))
+        return resolved
+
+    def resolve_album(self, songs):
+        """
+        Resolves songs that all come from one album.
+            return: list of uris, None for the ones not found
+        """
+        # A single song is one search either way
+        if len(songs) == 1:
+            return [self.spot.get_song_uri(songs[0])]
+
+        uris = [None] * len(songs)
+        album = self.spot.get_album_uri(songs[0])
+        if album is not None:
+            titles = {}
+            for track in self.spot.get_album_tracks(album):
+                titles.setdefault(title_key(track['name']), track['uri'])
+            for i, song in enumerate(songs):
+                uris[i] = titles.get(title_key(song.title))
+
+        for i, song in enumerate(songs):
+            if uris[i] is None:
+                uris[i] = self.spot.get_song_uri(song)
+        return uris
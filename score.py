@@ -0,0 +1,119 @@
+"""
+Scores Spotify search results against what we were looking for, so we can
+ask for a few candidates in one search and pick the right one locally
+instead of trusting whatever came first.
+"""
+
+import os
+from difflib import SequenceMatcher
+
+from normalize import artist_key, album_key, title_key
+
+def similarity(a, b):
+    """
+    How alike two keys are, from 0 to 1. Keys are already normalized, so
+    most matches are exact and the slower comparisons are only for the rest.
+    """
+    if a == b:
+        return 1.0
+    if a == '' or b == '':
+        return 0.0
+    words_a = set(a.split())
+    words_b = set(b.split())
+    overlap = len(words_a & words_b) / len(words_a | words_b)
+    return max(overlap, SequenceMatcher(None, a, b).ratio())
+
+def same_artist(a, b):
+    """
+    Checks if two artist keys name the same artist: they are equal, or
+    every word of one is in the other ("beatles" and "the beatles"). Names
+    that are only spelt alike, like "prince" and "princess", don't count.
+    """
+    if a == b:
+        return True
+    if a == '' or b == '':
+        return False
+    words_a = set(a.split())
+    words_b = set(b.split())
+    return words_a <= words_b or words_b <= words_a
+
+def artist_matches(candidate, artist):
+    """
+    How well a candidate's artist matches, None when none of its artists
+    is the one we have: plenty of songs and albums share a name, so the
+    candidate can't be accepted then. Without an artist to go on anything goes.
+    """
+    if artist == '':
+        return 0.0
+    keys = [artist_key(a['name']) for a in candidate.get('artists', [])]
+    matching = [similarity(key, artist) for key in keys if same_artist(key, artist)]
+    if len(matching) == 0:
+        return None
+    return max(matching)
+
+def best(candidates, score):
+    """
+    Picks the best scoring candidate.
+        return: (candidate, confidence), candidate None if nothing scores
+        above the threshold
+    """
+    best_candidate = None
+    best_score = 0.0
+    for candidate in candidates:
+        s = score(candidate)
+        if s > best_score:
+            best_candidate = candidate
+            best_score = s
+    # Below the threshold, the best candidate is treated as not found
+    if best_score < float(os.getenv('SPOTIFY_MATCH_THRESHOLD', '0.6')):
+        return (None, best_score)
+    return (best_candidate, best_score)
+
+def best_song(candidates, title, artist, album, track_number=None):
+    """
+    Picks the track that best matches on title, artist, album and position.
+    """
+    title = title_key(title)
+    artist = artist_key(artist)
+    album = album_key(album)
+
+    def score(candidate):
+        artist_score = artist_matches(candidate, artist)
+        if artist_score is None:
+            return 0.0
+        s = 0.5 * similarity(title_key(candidate['name']), title)
+        s += 0.3 * artist_score
+        if 'album' in candidate:
+            s += 0.2 * similarity(album_key(candidate['album']['name']), album)
+        if track_number and candidate.get('track_number') == track_number:
+            s = min(1.0, s + 0.05)
+        return s
+
+    return best(candidates, score)
+
+def best_album(candidates, artist, album):
+    """
+    Picks the album that best matches on name and artist.
+    """
+    artist = artist_key(artist)
+    album = album_key(album)
+
+    def score(candidate):
+        artist_score = artist_matches(candidate, artist)
+        if artist_score is None:
+            return 0.0
+        return 0.6 * similarity(album_key(candidate['name']), album) + 0.4 * artist_score
+
+    return best(candidates, score)
+
+def best_artist(candidates, artist):
+    """
+    Picks the artist that best matches by name.
+    """
+    artist = artist_key(artist)
+
+    def score(candidate):
+        key = artist_key(candidate['name'])
+        return similarity(key, artist) if same_artist(key, artist) else 0.0
+
+    return best(candidates, score)
@@ -1,10 +1,16 @@
-import sys
 import os
-import time
+from collections import Counter
 
+import requests
 import spotipy
 import spotipy.util as util
-from num2words import num2words
+
+from cache import SearchCache
+from ratelimit import RateLimiter
+from catalog import load_catalog
+from metrics import Metrics
+from normalize import artist_key, album_key, track_search, album_search, artist_search
+from score import best_song, best_album, best_artist
 
 class SpotifyClient:
     def __init__(self):
@@ -12,149 +18,344 @@ class SpotifyClient:
         This connects to Spotify's servers.
         """
         # This determines what the app has access to do
-        scope = 'user-library-read user-library-modify playlist-modify-private playlist-read-private playlist-modify-public'
+        scope = 'user-library-read user-library-modify playlist-modify-private playlist-read-private playlist-modify-public user-follow-read user-follow-modify'
         
         # username = input('Type your Spotify username below.\n--> ')
         username = os.getenv('SPOTIFY_USERNAME')
 
+        api_url = os.getenv('SPOTIFY_API_URL')
+        if api_url:
+            # Something standing in for Spotify, like bench/server.py, which needs no login
+            self.api = spotipy.Spotify(auth=os.getenv('SPOTIFY_TOKEN', 'local'), requests_session=session())
+            self.api.prefix = api_url
+        else:
+            self.login(username, scope)
+
+        self.cache = SearchCache(os.path.dirname(os.path.realpath(__file__)) + '/.cache-search-' + username)
+        self.limiter = RateLimiter()
+        self.catalog = load_catalog()
+        self.search_limit = int(os.getenv('SPOTIFY_SEARCH_LIMIT', '5'))
+        self.confidence = {}
+        # Artists and albums named in earlier results, by the same keys as
+        # LibraryIndex, so they can be looked up without a search of their own
+        self.known_artists = {}
+        self.known_albums = {}
+        self.derived = Counter()
+        self.user_id = None
+        self.playlists = None
+        self.saved_albums = None
+        self.followed_artists = None
+
+        self.metrics = Metrics()
+        self.metrics.watch('search_cache', lambda: { 'hits' : self.cache.hits, 'misses' : self.cache.misses })
+        self.metrics.watch('rate_limiter', lambda: { 'throttled' : self.limiter.throttled, 'backoff_seconds' : self.limiter.backoff_time,
+                                                     'rate' : self.limiter.rate, 'concurrency' : self.limiter.concurrency })
+        if self.catalog is not None:
+            self.metrics.watch('catalog', lambda: { 'hits' : self.catalog.hits, 'misses' : self.catalog.misses })
+        self.metrics.watch('derived', lambda: { 'artists' : self.derived['artists'], 'albums' : self.derived['albums'] })
+
+    def login(self, username, scope):
+        """
+        Gets a token for the user, asking them to log in if needed.
+        """
         # If used an old scope, we might have to delete the cache
         dir_path = os.path.dirname(os.path.realpath(__file__)) + '/.cache-spotify' + username
         cache = 0
         if(not os.path.isfile(dir_path)):
             cache = open(dir_path, 'w')
-            cache.write("v1.0")
+            cache.write("v1.1")
             if(os.path.isfile(f".cache-{username}")):
                 os.remove(f".cache-{username}") # Only needed if already ran the app in different mode
         else:
             cache = open(dir_path, 'r')
-            if(cache.read() != "v1.0"):
+            if(cache.read() != "v1.1"):
                 cache.close()
                 if(os.path.isfile(f".cache-{username}")):
                     os.remove(f".cache-{username}") # Only needed if already ran the app in different mode
                 cache = open(dir_path, 'w')
-                cache.write("v1.0")
+                cache.write("v1.1")
         cache.close()
 
         token = util.prompt_for_user_token(username=username, scope=scope, client_id=os.getenv("SPOTIFY_CLIENT_ID"), client_secret=os.getenv("SPOTIFY_CLIENT_SECRET"), redirect_uri=os.getenv('SPOTIFY_REDIRECT_URL'))
 
         if(token):
-            self.api = spotipy.Spotify(auth=token)
+            self.api = spotipy.Spotify(auth=token, requests_session=session())
             print('Connected to Spotify')
         else:
             print('Can\'t get the token for', username)
 
+    def call(self, fn, *args, **kwargs):
+        """
+        Makes a request to Spotify. Every request goes through here so they
+        share one rate limit, and throttled requests are retried. Each
+        attempt is timed for the metrics.
+        """
+        return self.limiter.call(throttled, self.metrics.timed(fn.__name__, fn), *args, **kwargs)
+
+    def close(self):
+        """
+        Writes out anything pending and reports how the search cache did,
+        writing the metrics to METRICS_FILE if it is set.
+        """
+        print(self.metrics.stats())
+        print(self.cache.stats())
+        print(self.limiter.stats())
+        if self.catalog is not None:
+            print(self.catalog.stats())
+        if self.derived:
+            print('Derived from earlier results: %d artists, %d albums' % (self.derived['artists'], self.derived['albums']))
+        self.cache.close()
+        if os.getenv('METRICS_FILE'):
+            self.metrics.dump(os.getenv('METRICS_FILE'))
+
+    def search(self, query, type):
+        """
+        Searches Spotify for a few candidate items of a type, going through
+        the search cache first. Misses are remembered too.
+            return: list of Spotify objects, best guess first
+        """
+        cached, items = self.cache.get(type, query)
+        if cached:
+            # Older caches kept a single item
+            if items is None:
+                return []
+            return items if isinstance(items, list) else [items]
+
+        results = self.call(self.api.search, q=query, type=type, limit=self.search_limit)
+        items = [compact(item) for item in results[type + 's']['items'] if item is not None]
+        self.cache.put(type, query, items)
+        return items
+
+    def found(self, item):
+        """
+        Remembers how confident we were in a match, for the log.
+            return: the uri, or None
+        """
+        if item is None:
+            return None
+        self.confidence[item['uri']] = item['confidence']
+        self.learn(item)
+        return item['uri']
+
+    def learn(self, item):
+        """
+        Remembers the artists a matched track or album names, and the album
+        a track is on, so they needn't be searched for later in the run.
+        """
+        album = item.get('album', item if item['uri'].startswith('spotify:album:') else None)
+        for artist in item.get('artists', []):
+            key = artist_key(artist['name'])
+            self.known_artists.setdefault(key, artist['uri'])
+            if album is not None:
+                self.known_albums.setdefault((key, album_key(album['name'])), album['uri'])
+
+    def known(self, kind, known, key):
+        """
+        Gets the uri of an artist or album named in an earlier result.
+        """
+        uri = known.get(key)
+        if uri is not None:
+            self.derived[kind] += 1
+            # The names matched exactly
+            self.confidence.setdefault(uri, 1.0)
+        return uri
+
+    def user(self):
+        """
+        Gets the current user's id, only asking Spotify the first time.
+        """
+        if self.user_id is None:
+            self.user_id = self.call(self.api.current_user)['id']
+        return self.user_id
+
+    def load_playlists(self):
+        """
+        Reads every page of the user's playlists into a map of name to id.
+        Only playlists the user owns are kept, as they are the ones we can
+        write to: a followed playlist's name gets a playlist of our own.
+        """
+        self.playlists = {}
+        page = self.call(self.api.current_user_playlists, limit=50)
+        while page is not None:
+            for lst in page['items']:
+                if lst['owner']['id'] == self.user():
+                    self.playlists.setdefault(lst['name'], lst['id'])
+            page = self.call(self.api.next, page) if page['next'] else None
+        return self.playlists
+
+    def get_album_tracks(self, album_uri):
+        """
+        Gets every track on an album, going through the search cache.
+            return: list of Spotify track objects
+        """
+        if self.catalog is not None:
+            tracks = self.catalog.get_album_tracks(album_uri)
+            if tracks is not None:
+                return tracks
+
+        cached, tracks = self.cache.get('album_tracks', album_uri)
+        if cached:
+            return tracks
+
+        tracks = []
+        page = self.call(self.api.album_tracks, album_uri, limit=50)
+        while page is not None:
+            tracks.extend(compact(track) for track in page['items'])
+            page = self.call(self.api.next, page) if page['next'] else None
+        self.cache.put('album_tracks', album_uri, tracks)
+        return tracks
+
     def add_playlist(self, playlist_name):
         """
         Adds a playlist to the library, if not already present.
         """
-        usr = self.api.current_user()['id']
         id = self.get_playlist(playlist_name)
         if(id == None):
-            self.api.user_playlist_create(user=usr, name=playlist_name, public=False)
-            return self.get_playlist(playlist_name)
-        else:
-            return id
+            id = self.call(self.api.user_playlist_create, user=self.user(), name=playlist_name, public=False)['id']
+            self.playlists[playlist_name] = id
+        return id
 
     def get_playlist(self, playlist_name):
         """
         Gets a playlist with a given name and returns its id.
         """
-        usr = self.api.current_user()['id']
-        p_lists = self.api.user_playlists(user=usr)['items']
-        for lst in p_lists:
-            if(lst['name'] == playlist_name):
-                return lst['id']
-        return None
+        if self.playlists is None:
+            self.load_playlists()
+        return self.playlists.get(playlist_name)
 
-    def add_song_to_playlist_uris(self, playlist_id, uris, repeat=True):
+    def add_song_to_playlist_uris(self, playlist_id, uris):
         """
         Adds a song to a playlist, specified by its Spotify id.
         """
-        usr = self.api.current_user()['id']
-        try:
-            self.api.user_playlist_add_tracks(user=usr, playlist_id=playlist_id, tracks=uris)
-        except spotipy.SpotifyException as e:
-            if e.http_status == 429 and repeat:
-                print('Spotify rate limit', e.headers['Retry-After'])
-                time.sleep(e.headers['Retry-After'] if 'Retry-After' in e.headers and e.headers['Retry-After'] < 120 else 30)
-                return self.add_song_to_playlist_uris(playlist_id, uris, False)
-            raise e
+        usr = self.user()
+        self.call(self.api.user_playlist_add_tracks, user=usr, playlist_id=playlist_id, tracks=uris)
 
     def replace_songs_to_playlist_uris(self, id, uris):
-        usr = self.api.current_user()['id']
+        usr = self.user()
+
+        self.call(self.api.user_playlist_replace_tracks, usr, id, uris)
 
-        self.api.user_playlist_replace_tracks(usr, id, uris)
+    def get_playlist_uris(self, playlist_id):
+        """
+        Gets the uris of every track in a playlist, in order.
+        """
+        usr = self.user()
+        uris = []
+        page = self.call(self.api.user_playlist_tracks, usr, playlist_id=playlist_id, fields='items(track(uri)),next', limit=100)
+        while page is not None:
+            for item in page['items']:
+                if item['track'] is not None:
+                    uris.append(item['track']['uri'])
+            page = self.call(self.api.next, page) if page['next'] else None
+        return uris
+
+    def remove_songs_from_playlist_uris(self, playlist_id, uris):
+        """
+        Removes every occurrence of some songs from a playlist.
+        """
+        usr = self.user()
+        self.call(self.api.user_playlist_remove_all_occurrences_of_tracks, usr, playlist_id, uris)
+
+    def move_song_in_playlist(self, playlist_id, start, before):
+        """
+        Moves the song at position start to before position before.
+        """
+        usr = self.user()
+        self.call(self.api.user_playlist_reorder_tracks, usr, playlist_id, range_start=start, insert_before=before)
 
     def get_song_uri(self, track):
         """
         Gets the Spotify URI for the tracks
             return: the Spotify URI
         """
+        # Try the local catalog before asking Spotify
+        if self.catalog is not None:
+            uri = self.catalog.find_song(track.title, track.artist, track.album)
+            if uri is not None:
+                self.confidence[uri] = 1.0
+                return uri
+
         # Get the song info from Google
-        trackname = track['title'].replace("'", "")
-        artistname = track['artist'].replace("'", "")
-        albumname = track['album'].replace("'", "")
+        trackname = track.title
+        artistname = track.artist
+        albumname = track.album
 
         # Find the song on spotify
-        song = self.find_song(trackname, artistname, albumname)
+        song = self.find_song(trackname, artistname, albumname, track.track_number)
 
         # If no result, say so.
-        if(song == None):
-            return None
-        else:
-            return song['uri']
+        return self.found(song)
 
-    def find_song(self, trackname, artistname, albumname):
+    def find_song(self, trackname, artistname, albumname, track_number=None):
         """
         Finds a song from Spotify based on the track name and
         artist name. It will shorten the names in order to find
         the closest match, since many will not fit exactly.
             return: Spotify song object
         """
-        # Fix the artist name
-        artistname = artistname.replace('and', ' ')
-
-        # Fix the title
-        translation_table = dict.fromkeys(map(ord, ';/"()&'), ' ')
-        artistname = artistname.translate(translation_table)
-        trackname = trackname.translate(translation_table)
-        albumname = albumname.translate(translation_table)
-
-        string = "track:" + trackname
-        string += " artist:" + artistname
-        string += " album:" + albumname
-        results = self.api.search(q=string, type='track', limit=1)
-        items = results['tracks']['items']
-
-        if (len(items) == 0):
-            return None
-        else:
-            return items[0]
+        string = track_search(trackname, artistname, albumname)
+        return pick(best_song(self.search(string, 'track'), trackname, artistname, albumname, track_number))
 
     def add_album_uris(self, uris):
         """
         Adds a track to the Spotify account. Returns if it was
         successfully found on Spotify.
         """
-        self.api.current_user_saved_albums_add(uris)
+        self.call(self.api.current_user_saved_albums_add, uris)
+        self.load_saved_albums().uris.update(uris)
+
+    def load_saved_albums(self):
+        """
+        Reads every page of the user's saved albums, the first time it is needed.
+        """
+        if self.saved_albums is None:
+            saved = Owned()
+            page = self.call(self.api.current_user_saved_albums, limit=50)
+            while page is not None:
+                for item in page['items']:
+                    album = item['album']
+                    saved.add(album['uri'], [(artist_key(artist['name']), album_key(album['name'])) for artist in album['artists']])
+                page = self.call(self.api.next, page) if page['next'] else None
+            self.saved_albums = saved
+        return self.saved_albums
+
+    def has_album(self, track):
+        """
+        Checks if the album of a track is already saved, without searching.
+        """
+        return self.load_saved_albums().has_key((artist_key(track.artist), album_key(track.album)))
+
+    def has_album_uri(self, uri):
+        """
+        Checks if an album is already saved.
+        """
+        return uri in self.load_saved_albums().uris
 
     def get_album_uri(self, track):
         """
         Gets the Spotify URI for the tracks
             return: the Spotify URI
         """
+        # Try the local catalog before asking Spotify
+        if self.catalog is not None:
+            uri = self.catalog.find_album(track.artist, track.album)
+            if uri is not None:
+                self.confidence[uri] = 1.0
+                return uri
+
+        uri = self.known('albums', self.known_albums, (artist_key(track.artist), album_key(track.album)))
+        if uri is not None:
+            return uri
+
         # Get the song info from Google
-        artistname = track['artist'].replace("'", "")
-        albumname = track['album'].replace("'", "")
+        artistname = track.artist
+        albumname = track.album
 
         # Find the song on spotify
         song = self.find_album(artistname, albumname)
 
         # If no result, say so.
-        if(song == None):
-            return None
-        else:
-            return song['uri']
+        return self.found(song)
 
     def find_album(self, artistname, albumname):
         """
@@ -163,47 +364,67 @@ class SpotifyClient:
         the closest match, since many will not fit exactly.
             return: Spotify song object
         """
-        # Fix the artist name
-        artistname = artistname.replace('and', ' ')
-
-        # Fix the title
-        translation_table = dict.fromkeys(map(ord, ';/"()&'), ' ')
-        artistname = artistname.translate(translation_table)
-        albumname = albumname.translate(translation_table)
-
-        string = "artist:" + artistname
-        string += " album:" + albumname
-        results = self.api.search(q=string, type='album', limit=1)
-        items = results['albums']['items']
-
-        if(len(items) == 0):
-            return None
-        else:
-            return items[0]
+        string = album_search(artistname, albumname)
+        return pick(best_album(self.search(string, 'album'), artistname, albumname))
 
     def add_artist_uris(self, uris):
         """
         Adds a track to the Spotify account. Returns if it was
         successfully found on Spotify.
         """
-        self.api.user_follow_artists(uris)
+        self.call(self.api.user_follow_artists, uris)
+        self.load_followed_artists().uris.update(uris)
+
+    def load_followed_artists(self):
+        """
+        Reads every page of the artists the user follows, the first time it is needed.
+        """
+        if self.followed_artists is None:
+            followed = Owned()
+            page = self.call(self.api.current_user_followed_artists, limit=50)['artists']
+            while page is not None:
+                for artist in page['items']:
+                    followed.add(artist['uri'], [artist_key(artist['name'])])
+                page = self.call(self.api.next, page)['artists'] if page['next'] else None
+            self.followed_artists = followed
+        return self.followed_artists
+
+    def has_artist(self, track):
+        """
+        Checks if the artist of a track is already followed, without searching.
+        """
+        return self.load_followed_artists().has_key(artist_key(track.artist))
+
+    def has_artist_uri(self, uri):
+        """
+        Checks if an artist is already followed.
+        """
+        return uri in self.load_followed_artists().uris
 
     def get_artist_uri(self, track):
         """
         Gets the Spotify URI for the tracks
             return: the Spotify URI
         """
+        # Try the local catalog before asking Spotify
+        if self.catalog is not None:
+            uri = self.catalog.find_artist(track.artist)
+            if uri is not None:
+                self.confidence[uri] = 1.0
+                return uri
+
+        uri = self.known('artists', self.known_artists, artist_key(track.artist))
+        if uri is not None:
+            return uri
+
         # Get the song info from Google
-        artistname = track['artist'].replace("'", "")
+        artistname = track.artist
 
         # Find the song on spotify
         song = self.find_arist(artistname)
 
         # If no result, say so.
-        if(song == None):
-            return None
-        else:
-            return song['uri']
+        return self.found(song)
 
     def find_arist(self, artistname):
         """
@@ -212,19 +433,75 @@ class SpotifyClient:
         the closest match, since many will not fit exactly.
             return: Spotify song object
         """
-        # Fix the artist name
-        artistname = artistname.replace('and', ' ')
-
-        # Fix the title
-        translation_table = dict.fromkeys(map(ord, ';/"()&'), ' ')
-        artistname = artistname.translate(translation_table)
+        string = artist_search(artistname)
+        return pick(best_artist(self.search(string, 'artist'), artistname))
 
-        string = "artist:" + artistname
-        results = self.api.search(q=string, type='artist', limit=1)
-        items = results['artists']['items']
-
-        if(len(items) == 0):
-            return None
-        else:
-            return items[0]
 
+class Owned:
+    """
+    The uris and names of things the user already has on Spotify, so we
+    can skip them both before searching and before saving.
+    """
+    def __init__(self):
+        self.uris = set()
+        self.keys = set()
+
+    def add(self, uri, keys):
+        self.uris.add(uri)
+        self.keys.update(keys)
+
+    def has_key(self, key):
+        return key in self.keys
+
+def session():
+    """
+    A requests session that never retries by itself. spotipy's own retries
+    turn a 429 into an error without its Retry-After (and 5xx into a 429),
+    here every failed request reaches throttled() with its real status and
+    headers, and our rate limiter decides when to try again.
+    """
+    s = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(max_retries=0)
+    s.mount('http://', adapter)
+    s.mount('https://', adapter)
+    return s
+
+def throttled(e):
+    """
+    Decides if a failed request should be retried. Rate limited requests
+    wait exactly as long as Spotify's Retry-After header says, server errors
+    and dropped connections back off and try again.
+    """
+    if isinstance(e, spotipy.SpotifyException):
+        if e.http_status == 429:
+            headers = e.headers or {}
+            retry_after = headers.get('Retry-After', headers.get('retry-after'))
+            try:
+                return float(retry_after)
+            except (TypeError, ValueError):
+                return True
+        return e.http_status in (500, 502, 503, 504)
+    return isinstance(e, (requests.ConnectionError, requests.Timeout))
+
+def pick(scored):
+    """
+    Turns a (candidate, confidence) pair into the candidate with its
+    confidence attached, or None.
+    """
+    candidate, confidence = scored
+    if candidate is None:
+        return None
+    return dict(candidate, confidence=confidence)
+
+def compact(item):
+    """
+    Strips a Spotify search result down to what we use, so it is cheap to cache.
+    """
+    small = { 'uri' : item['uri'], 'id' : item['id'], 'name' : item['name'] }
+    if 'artists' in item:
+        small['artists'] = [{ 'uri' : a['uri'], 'name' : a['name'] } for a in item['artists']]
+    if 'album' in item:
+        small['album'] = { 'uri' : item['album']['uri'], 'name' : item['album']['name'] }
+    if 'track_number' in item:
+        small['track_number'] = item['track_number']
+    return small
@@ -0,0 +1,98 @@
+from bisect import bisect_left
+
+from writer import PLAYLIST_BATCH
+
+def plan(current, wanted):
+    """
+    Works out the writes needed to turn a playlist holding the current uris
+    into one holding the wanted uris, in order. Returns a list of steps:
+        ('replace', uris) - set the playlist to exactly these uris
+        ('add', uris)     - append these uris
+        ('remove', uris)  - remove these uris
+        ('move', start, before) - move the track at start to before index before
+    Tracks that stay are left alone, and when that would take more requests
+    than just rewriting the playlist we rewrite it. An empty list means the
+    playlist is already right.
+    """
+    if current == wanted:
+        return []
+    if current == wanted[:len(current)]:
+        return [('add', wanted[len(current):])]
+    replace = [('replace', wanted)]
+    # Moving duplicates around is ambiguous, just rewrite those
+    if len(set(current)) != len(current) or len(set(wanted)) != len(wanted):
+        return replace
+
+    wanted_set = set(wanted)
+    current_set = set(current)
+    removes = [uri for uri in current if uri not in wanted_set]
+    adds = [uri for uri in wanted if uri not in current_set]
+
+    # What the playlist looks like after removing and appending
+    tracks = [uri for uri in current if uri in wanted_set] + adds
+    moves = []
+    position = { uri : i for i, uri in enumerate(wanted) }
+    keep = longest_increasing([position[uri] for uri in tracks])
+    for i, uri in enumerate(wanted):
+        if i in keep:
+            continue
+        start = tracks.index(uri)
+        before = tracks.index(wanted[i - 1]) + 1 if i > 0 else 0
+        if before == start or before == start + 1:
+            continue
+        move(tracks, start, before)
+        moves.append(('move', start, before))
+
+    steps = []
+    if len(removes) > 0:
+        steps.append(('remove', removes))
+    if len(adds) > 0:
+        steps.append(('add', adds))
+    steps.extend(moves)
+    if requests(steps) >= requests(replace):
+        return replace
+    return steps
+
+def requests(steps):
+    """
+    Counts how many requests it takes to carry out some steps.
+    """
+    count = 0
+    for step in steps:
+        if step[0] == 'move':
+            count += 1
+        else:
+            count += max(1, -(-len(step[1]) // PLAYLIST_BATCH))
+    return count
+
+def move(tracks, start, before):
+    """
+    Moves a track the same way Spotify's reorder does.
+    """
+    tracks.insert(before, tracks[start])
+    del tracks[start if before > start else start + 1]
+
+def longest_increasing(positions):
+    """
+    Finds the longest run of positions that are already in order (not
+    necessarily next to each other), those tracks don't need to move.
+        return: the set of those positions
+    """
+    tails = []
+    tail_index = []
+    previous = [-1] * len(positions)
+    for i, p in enumerate(positions):
+        j = bisect_left(tails, p)
+        if j == len(tails):
+            tails.append(p)
+            tail_index.append(i)
+        else:
+            tails[j] = p
+            tail_index[j] = i
+        previous[i] = tail_index[j - 1] if j > 0 else -1
+    keep = set()
+    i = tail_index[-1] if len(tail_index) > 0 else -1
+    while i >= 0:
+        keep.add(positions[i])
+        i = previous[i]
+    return keep
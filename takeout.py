@@ -1,107 +1,313 @@
 import os
+import io
 import csv
+import glob
+import hashlib
+import pickle
+import zipfile
+
+from parallel import imap
+from track import Track, to_int
 
 class GoogleMusicTakeoutClient:
     def __init__(self):
+        """
+        GOOGLE_TAKEOUT_DIR is the extracted "Google Play Music" folder, or
+        the Takeout .zip itself. Takeout splits big exports over several
+        zips, those can be listed separated by the path separator (: or ;)
+        or left in a folder of their own.
+        """
         self.dir = os.getenv('GOOGLE_TAKEOUT_DIR')
+        # Reading the CSVs is mostly waiting on the disk, so use plenty of threads
+        self.workers = int(os.getenv('GOOGLE_TAKEOUT_WORKERS', '16'))
+        self.files = takeout_files(self.dir.split(os.pathsep))
+        index_path = os.path.dirname(os.path.realpath(__file__)) + '/.cache-takeout-' + hashlib.md5(self.files.name.encode()).hexdigest()[:12]
+        self.index = TakeoutIndex(index_path)
 
     def get_playlists(self):
         """
         Gets all the playlists in Google Play Music. Some may not actually
-        have any music, but they will be processed anyways.
-        """
-
-        lists = []
-        for playlistDir in os.listdir(self.dir + '/Playlists'):
-            if playlistDir.startswith('.'):
-                continue
-            if playlistDir.lower() == 'thumbs up':
-                continue
-            playlistName = self.name_from_metadata(self.dir + '/Playlists/' + playlistDir + '/Metadata.csv')
-            if playlistName is None:
-                continue
-            tracks = []
-            for trackFile in os.listdir(self.dir + '/Playlists/' + playlistDir + '/Tracks'):
-                if trackFile.startswith('.'):
+        have any music, but they will be processed anyways. Playlists are
+        read one at a time as they are needed.
+        """
+        try:
+            for name in self.files.folders('Playlists'):
+                if name.lower() == 'thumbs up':
                     continue
-                track = self.track_from_file(self.dir + '/Playlists/' + playlistDir + '/Tracks/' + trackFile)
-                if track is None:
+                metadata = self.files.find('Playlists/' + name, 'Metadata.csv')
+                if metadata is None:
                     continue
-                tracks.append(track)
-            lists.append(Playlist(playlistName, tracks))
-
-        return Playlists(lists)
+                playlistName = self.index.get(metadata, self.name_from_metadata)
+                if playlistName is None:
+                    continue
+                # The entries' files are named after the songs, their place in the playlist is in the CSV
+                entries = sorted(self.read_dir('Playlists/' + name + '/Tracks', self.entry_from_file), key=lambda entry: entry[0])
+                playlist = Playlist(playlistName, [track for index, track in entries])
+                if playlist.has_songs():
+                    yield playlist
+        finally:
+            self.index.save()
 
-    def name_from_metadata(self, path):
-        with open(path, newline='') as csvfile:
+    def name_from_metadata(self, key):
+        with self.files.open(key) as csvfile:
             reader = csv.DictReader(csvfile)
             for row in reader:
                 return row['Title']
         return None
 
-    def track_from_file(self, path):
-        with open(path, newline='') as csvfile:
+    def track_from_file(self, key):
+        with self.files.open(key) as csvfile:
             reader = csv.DictReader(csvfile)
             for row in reader:
-                if row['Removed'] == 'Yes':
-                    return None
-                if row['Title'] == '' or row['Album'] == '' or row['Artist'] == '':
+                return track_from_row(row)
+        return None
+
+    def entry_from_file(self, key):
+        """
+        Reads a playlist entry.
+            return: (its place in the playlist, the track), or None
+        """
+        with self.files.open(key) as csvfile:
+            reader = csv.DictReader(csvfile)
+            for row in reader:
+                track = track_from_row(row)
+                if track is None:
                     return None
-                return { "title" : row['Title'], "album" : row['Album'], "artist" : row['Artist'], "deleted" : False, 'playCount' : row['Play Count'] }
+                return (to_int(row.get('Playlist Index')), track)
         return None
 
+    def read_dir(self, path, parse):
+        """
+        Parses every CSV in a directory (relative to the Takeout), several
+        at a time, yielding what parse returns in file name order as soon
+        as it is ready. Files that parse to None are skipped.
+        """
+        # Only files that changed since the last run are actually parsed
+        for value in imap(lambda file: self.index.get(file, parse), self.files.list(path), self.workers):
+            if value is not None:
+                yield value
+        self.index.scanned(path)
+
+    def count_songs(self):
+        """
+        How many tracks the library has (at most), without reading them.
+        """
+        return self.files.count('Tracks')
+
     def get_all_songs(self):
         """
-        Gets the entire Google library for adding to the
+        Gets the entire Google library for adding to the. The tracks are
+        yielded as they are read, so matching can start straight away.
         """
-        tracks = []
-        for trackFile in os.listdir(self.dir + '/Tracks'):
-            if trackFile.startswith('.'):
-                continue
-            track = self.track_from_file(self.dir + '/Tracks/' + trackFile)
-            if track is None:
-                continue
-            tracks.append(track)
+        try:
+            yield from self.read_dir('Tracks', self.track_from_file)
+        finally:
+            self.index.save()
+
+def track_from_row(row):
+    if row['Removed'] == 'Yes':
+        return None
+    if row['Title'] == '' or row['Album'] == '' or row['Artist'] == '':
+        return None
+    # Takeout play counts have never been used to leave songs out
+    return Track(row['Title'], row['Artist'], row['Album'], play_count=None)
 
-        return MusicLibrary(tracks)
+def takeout_files(paths):
+    """
+    Picks how to read the Takeout from where it is: an extracted folder,
+    one or more zips, or a folder holding the zips.
+    """
+    if len(paths) == 1 and os.path.isdir(paths[0]) and not os.path.isdir(os.path.join(paths[0], 'Tracks')):
+        zips = sorted(glob.glob(os.path.join(paths[0], '*.zip')))
+        if len(zips) > 0:
+            paths = zips
+    if all(zipfile.is_zipfile(path) for path in paths):
+        return TakeoutArchives(paths)
+    if len(paths) > 1:
+        raise Exception('Only zips can be given as several Takeout paths')
+    return TakeoutFolder(paths[0])
 
-class Playlists:
+class TakeoutFile:
     """
-    Playlists is an iterable object which simply contains
-    all the playlists, excluding the playlists with no songs.
+    A CSV somewhere in the Takeout. key says where to read it from, stamp
+    changes whenever the file does and folder is the directory it is in.
     """
-    def __init__(self, lists):
+    __slots__ = ('name', 'key', 'stamp', 'folder')
+
+    def __init__(self, name, key, stamp, folder):
+        self.name = name
+        self.key = key
+        self.stamp = stamp
+        self.folder = folder
+
+class TakeoutFolder:
+    """
+    TakeoutFolder reads an extracted Takeout.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.name = os.path.realpath(path)
+
+    def folders(self, path):
         """
-        Creates a new playlist object
+        Gets the names of the folders in a directory, in order.
         """
-        self.playlists = []
-        for plist in lists:
-            # Only add it if it has songs
-            if(plist.has_songs()):
-                self.playlists.append(plist)
-        self.p_index = 0
+        return sorted(entry.name for entry in os.scandir(self.path + '/' + path) if not entry.name.startswith('.') and entry.is_dir())
 
-    def start_from(self, i):
+    def list(self, path):
         """
-        Sets the index to start reading the library from.
+        Gets the CSV files in a directory, in name order.
         """
-        self.index = i
+        for entry in sorted(self.csv_files(path), key=lambda e: e.name):
+            stat = entry.stat()
+            yield TakeoutFile(entry.name, entry.path, (stat.st_mtime_ns, stat.st_size), path)
 
-    def __iter__(self):
+    def count(self, path):
         """
-        Allows iterating over all the playlists.
+        Counts the CSV files in a directory, without looking at them.
         """
-        return self
+        return sum(1 for entry in self.csv_files(path))
 
-    def __next__(self):
+    def csv_files(self, path):
         """
-        Gets the next playlist
+        Gets the CSV files in a directory. Like in the zips, the audio next
+        to them is skipped.
         """
-        self.p_index += 1
-        if(self.p_index <= len(self.playlists)):
-            return self.playlists[self.p_index - 1]
-        else:
-            raise StopIteration
+        return (entry for entry in os.scandir(self.path + '/' + path)
+                if not entry.name.startswith('.') and entry.name.lower().endswith('.csv') and entry.is_file())
+
+    def find(self, path, name):
+        """
+        Gets one file from a directory, or None if it isn't there.
+        """
+        full = self.path + '/' + path + '/' + name
+        if not os.path.isfile(full):
+            return None
+        stat = os.stat(full)
+        return TakeoutFile(name, full, (stat.st_mtime_ns, stat.st_size), path)
+
+    def open(self, key):
+        return open(key, newline='')
+
+class TakeoutArchives:
+    """
+    TakeoutArchives reads the Takeout straight out of its zips. Only the
+    zips' tables of contents are read up front, the audio in them is never
+    touched and each CSV is streamed from its zip when it is parsed.
+    """
+    def __init__(self, paths):
+        self.zips = {}
+        self.dirs = {} # Directory relative to the Takeout -> {name: TakeoutFile}
+        self.name = os.pathsep.join(sorted(os.path.realpath(path) for path in paths))
+        for path in paths:
+            archive = zipfile.ZipFile(path)
+            self.zips[path] = archive
+            for info in archive.infolist():
+                folder = takeout_folder(info.filename)
+                if folder is None:
+                    continue
+                name = info.filename.rsplit('/', 1)[-1]
+                stamp = (info.date_time, info.file_size, info.CRC)
+                self.dirs.setdefault(folder, {})[name] = TakeoutFile(name, (path, info.filename), stamp, folder)
+
+    def folders(self, path):
+        prefix = path + '/'
+        return sorted({ folder[len(prefix):].split('/', 1)[0] for folder in self.dirs if folder.startswith(prefix) })
+
+    def list(self, path):
+        files = self.dirs.get(path, {})
+        return [files[name] for name in sorted(files) if not name.startswith('.')]
+
+    def count(self, path):
+        return len(self.list(path))
+
+    def find(self, path, name):
+        return self.dirs.get(path, {}).get(name)
+
+    def open(self, key):
+        archive, member = key
+        return io.TextIOWrapper(self.zips[archive].open(member), encoding='utf-8', newline='')
+
+def takeout_folder(member):
+    """
+    Works out which Takeout directory a zip member belongs in, whatever
+    folders the zip wraps it in:
+        .../Tracks/<song>.csv                    -> Tracks
+        .../Playlists/<name>/Metadata.csv        -> Playlists/<name>
+        .../Playlists/<name>/Tracks/<entry>.csv  -> Playlists/<name>/Tracks
+    Anything else (like the audio files) gives None.
+    """
+    parts = member.split('/')
+    if not parts[-1].lower().endswith('.csv'):
+        return None
+    if len(parts) >= 4 and parts[-2] == 'Tracks' and parts[-4] == 'Playlists':
+        return 'Playlists/' + parts[-3] + '/Tracks'
+    if len(parts) >= 3 and parts[-1] == 'Metadata.csv' and parts[-3] == 'Playlists':
+        return 'Playlists/' + parts[-2]
+    if len(parts) >= 2 and parts[-2] == 'Tracks':
+        return 'Tracks'
+    return None
+
+class TakeoutIndex:
+    """
+    TakeoutIndex remembers what we parsed out of each Takeout file last
+    time, along with the file's stamp (modification time and size). When
+    that hasn't changed the file isn't read again.
+    """
+    version = 5
+
+    def __init__(self, path):
+        """
+        Loads the index from path, starting empty if it is missing or old.
+        """
+        self.path = path
+        self.entries = {}
+        self.seen = set()
+        self.complete = set()
+        self.dirty = False
+        if os.path.isfile(path):
+            try:
+                with open(path, 'rb') as index_file:
+                    version, entries = pickle.load(index_file)
+                if version == self.version:
+                    self.entries = entries
+            except (OSError, EOFError, ValueError, pickle.UnpicklingError):
+                pass
+
+    def get(self, file, parse):
+        """
+        Gets what parse(file.key) returns, from the index when the file is
+        the same as last time.
+        """
+        self.seen.add(file.key)
+        cached = self.entries.get(file.key)
+        if cached is not None and cached[0] == file.stamp:
+            return cached[1]
+        value = parse(file.key)
+        self.entries[file.key] = (file.stamp, value, file.folder)
+        self.dirty = True
+        return value
+
+    def scanned(self, folder):
+        """
+        Marks a directory as completely read, so files that have gone from
+        it can be forgotten.
+        """
+        self.complete.add(folder)
+
+    def save(self):
+        """
+        Writes the index out if anything changed.
+        """
+        for key in [k for k, entry in self.entries.items() if k not in self.seen and entry[2] in self.complete]:
+            del self.entries[key]
+            self.dirty = True
+        if not self.dirty:
+            return
+        with open(self.path + '.tmp', 'wb') as index_file:
+            pickle.dump((self.version, self.entries), index_file, pickle.HIGHEST_PROTOCOL)
+        os.replace(self.path + '.tmp', self.path)
+        self.dirty = False
 
 class Playlist:
     """
@@ -147,34 +353,3 @@ class Playlist:
             raise StopIteration
         else:
             return self.tracks[self.index - 1]
-
-class MusicLibrary:
-    def __init__(self, lib):
-        """
-        Creates a new music library.
-        """
-        self.library = lib
-        self.index = 0 # We start at the 0-index location when adding songs
-
-    def start_from(self, i):
-        """
-        Sets the index to start reading the library from.
-        """
-        self.index = i
-
-    def __iter__(self):
-        """
-        Allows iterating over the entire library, starting
-        from the starting index.
-        """
-        return self
-
-    def __next__(self):
-        """
-        Gets the next track in the library, if available.
-        """
-        self.index = self.index + 1
-        if(self.index > len(self.library)):
-            raise StopIteration
-        else:
-            return self.library[self.index - 1]
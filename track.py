@@ -0,0 +1,46 @@
+import sys
+
+class Track:
+    """
+    A Track is just what we use of a song from Google: its title, artist,
+    album, track number, play count and whether it was deleted. Google's
+    song dicts carry dozens of other fields, and big libraries have a lot
+    of songs, so this keeps only those in slots, and shares the artist
+    and album strings between all the tracks that have them. play_count
+    is None when it isn't used to choose what to migrate.
+    """
+    __slots__ = ('title', 'artist', 'album', 'track_number', 'play_count', 'deleted')
+
+    def __init__(self, title, artist, album, track_number=None, play_count=0, deleted=False):
+        self.title = title
+        self.artist = sys.intern(artist)
+        self.album = sys.intern(album)
+        self.track_number = track_number
+        self.play_count = play_count
+        self.deleted = deleted
+
+    @classmethod
+    def from_gmusic(cls, song):
+        """
+        Makes a track from one of gmusicapi's song dicts.
+        """
+        return cls(song.get('title', ''), song.get('artist', ''), song.get('album', ''),
+                   song.get('trackNumber'), to_int(song.get('playCount')), bool(song.get('deleted', False)))
+
+    def __getstate__(self):
+        return (self.title, self.artist, self.album, self.track_number, self.play_count, self.deleted)
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+    def __repr__(self):
+        return 'Track(%r, %r, %r)' % (self.title, self.artist, self.album)
+
+def to_int(value):
+    """
+    Reads a number that might be missing or text, like the Takeout play counts.
+    """
+    try:
+        return int(value or 0)
+    except (TypeError, ValueError):
+        return 0
@@ -0,0 +1,108 @@
+from concurrent.futures import ThreadPoolExecutor
+
+# The most uris each Spotify endpoint takes in one request
+SAVED_ALBUMS_BATCH = 20
+FOLLOWED_ARTISTS_BATCH = 50
+PLAYLIST_BATCH = 100
+
+class BatchWriter:
+    """
+    BatchWriter collects uris for each target (saved albums, followed
+    artists, a playlist) and writes them in the biggest batches the
+    endpoint takes. Writes happen in the background so searching carries
+    on meanwhile. Different targets are written at the same time, but
+    each target's writes happen in the order they were added, so playlist
+    tracks stay in order.
+    """
+    def __init__(self, workers=2):
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.targets = {}
+
+    def target(self, key, write, limit, first=None, unique=False, done=None):
+        """
+        Sets up a target. write(uris) sends one batch, first(uris) (if
+        given) sends the first batch instead, e.g. to replace a playlist.
+        With unique, a uri is only written once. done(uris) is called after
+        each batch is written.
+        """
+        target = Target(write, limit, first, unique, done)
+        if key in self.targets:
+            # Setting a target up again still waits for what it already had queued
+            self.flush(key)
+            target.last = self.targets[key].last
+        self.targets[key] = target
+
+    def add(self, key, uris):
+        """
+        Queues uris for a target, writing any full batches.
+        """
+        target = self.targets[key]
+        for uri in uris:
+            if target.unique:
+                if uri in target.seen:
+                    continue
+                target.seen.add(uri)
+            target.pending.append(uri)
+            if len(target.pending) >= target.limit:
+                self.flush(key)
+
+    def flush(self, key):
+        """
+        Writes whatever is queued for a target, even if it isn't a full batch.
+        """
+        target = self.targets[key]
+        if len(target.pending) == 0:
+            return
+        uris = target.pending
+        target.pending = []
+        write = target.write
+        if target.first is not None:
+            write = target.first
+            target.first = None
+
+        def send():
+            write(uris)
+            if target.done is not None:
+                target.done(uris)
+        self.run(key, send)
+
+    def run(self, key, fn):
+        """
+        Runs fn in the background once everything already queued for the
+        target has been written.
+        """
+        self.flush(key)
+        target = self.targets[key]
+        previous = target.last
+
+        def after():
+            if previous is not None:
+                # Raises if an earlier write failed, so nothing after it goes out
+                previous.result()
+            fn()
+        target.last = self.pool.submit(after)
+
+    def close(self):
+        """
+        Writes everything still queued and waits for it. Raises the first
+        error a write hit.
+        """
+        for key in list(self.targets):
+            self.flush(key)
+        try:
+            for target in self.targets.values():
+                if target.last is not None:
+                    target.last.result()
+        finally:
+            self.pool.shutdown()
+
+class Target:
+    def __init__(self, write, limit, first, unique, done):
+        self.write = write
+        self.limit = limit
+        self.first = first
+        self.unique = unique
+        self.done = done
+        self.pending = []
+        self.seen = set()
+        self.last = None